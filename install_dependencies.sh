@@ -31,6 +31,10 @@ pip install -r requirements.txt --break-system-packages
 wget https://cdn.pisugar.com/EchoView/NotoSansSC-Bold.ttf
 wget https://cdn.pisugar.com/EchoView/emoji_svg.zip
 unzip emoji_svg.zip 
+# pre-render the emoji at the sizes used by the UI
+python3 build_emoji_atlas.py
+# pre-render GB2312, ASCII and punctuation glyphs at the sizes used by the UI
+python3 build_font_pack.py
 cd ..
 
 
@@ -0,0 +1,48 @@
+import argparse
+import json
+import os
+
+from utils import EmojiUtils
+
+# Emoji sizes used by the UI: main text, status line and the large header emoji
+DEFAULT_SIZES = [20, 24, 40]
+
+
+def build_emoji_atlas(svg_dir, output, sizes):
+    """Render every SVG in `svg_dir` at `sizes` into <output>.bin (packed RGBA
+    sprites) and <output>.json (offset, width, height of each sprite)."""
+    sprites = {}
+    offset = 0
+    filenames = sorted(name for name in os.listdir(svg_dir) if name.endswith(".svg"))
+    with open(output + ".bin.tmp", "wb") as atlas:
+        for i, filename in enumerate(filenames):
+            stem = filename[:-4]
+            entries = {}
+            for size in sizes:
+                try:
+                    image = EmojiUtils.render_emoji_svg(os.path.join(svg_dir, filename), size)
+                except Exception as e:
+                    print(f"[Atlas] Failed to render {filename} at {size}px: {e}")
+                    continue
+                data = image.tobytes("raw", "RGBA")
+                atlas.write(data)
+                entries[str(size)] = [offset, image.width, image.height]
+                offset += len(data)
+            if entries:
+                sprites[stem] = entries
+            if (i + 1) % 500 == 0:
+                print(f"[Atlas] Rendered {i + 1}/{len(filenames)} emoji")
+    with open(output + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": 1, "sizes": sizes, "sprites": sprites}, f, separators=(",", ":"))
+    os.replace(output + ".bin.tmp", output + ".bin")
+    os.replace(output + ".json.tmp", output + ".json")
+    print(f"[Atlas] Wrote {len(sprites)} emoji ({offset / 1024 / 1024:.1f} MB) to {output}.bin")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render emoji SVGs into a memory-mappable sprite atlas")
+    parser.add_argument("--svg-dir", default="emoji_svg")
+    parser.add_argument("--output", default="emoji_atlas")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    args = parser.parse_args()
+    build_emoji_atlas(args.svg_dir, args.output, args.sizes)
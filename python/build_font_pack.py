@@ -0,0 +1,95 @@
+import argparse
+import os
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+from utils import FontPack
+
+# Font sizes used by the UI: status line, main text, and the header emoji/title
+DEFAULT_SIZES = [13, 20, 24, 40]
+DEFAULT_FONT = "NotoSansSC-Bold.ttf"
+
+# Unicode ranges always included: ASCII, general punctuation, CJK punctuation
+# and full-width forms
+DEFAULT_RANGES = [(0x20, 0x7E), (0x2000, 0x206F), (0x3000, 0x303F), (0xFF00, 0xFFEF)]
+
+
+def default_charset():
+    """ASCII, common punctuation and every character in GB2312"""
+    chars = set()
+    for start, end in DEFAULT_RANGES:
+        chars.update(chr(codepoint) for codepoint in range(start, end + 1))
+    for high in range(0xA1, 0xF8):
+        for low in range(0xA1, 0xFF):
+            try:
+                chars.add(bytes([high, low]).decode("gb2312"))
+            except UnicodeDecodeError:
+                pass
+    return chars
+
+
+def render_glyph(font, char):
+    """Render `char` the same way GlyphAtlas does: an 8-bit mask of its bbox"""
+    left, top, right, bottom = font.getbbox(char)
+    if right <= left or bottom <= top:
+        return None, left, top, right - left, bottom - top
+    mask = Image.new("L", (right - left, bottom - top), 0)
+    ImageDraw.Draw(mask).text((-left, -top), char, font=font, fill=255)
+    return np.asarray(mask), left, top, right - left, bottom - top
+
+
+def build_font_pack(font_path, output, sizes, charset):
+    """Render `charset` at `sizes` into a FontPack file: header, size table,
+    per-size glyph index sorted by code point, then the glyph masks."""
+    name = os.path.basename(font_path).encode("utf-8")
+    name_padded = name + b"\0" * ((len(name) + 3) // 4 * 4 - len(name))
+    header = np.zeros(1, dtype=FontPack.HEADER_DTYPE)
+    header[0] = (FontPack.MAGIC, FontPack.VERSION, len(sizes), len(name), 0)
+    size_table = np.zeros(len(sizes), dtype=FontPack.SIZE_DTYPE)
+    offset = header.nbytes + len(name_padded) + size_table.nbytes
+
+    indexes = []
+    masks = []
+    for i, size in enumerate(sizes):
+        font = ImageFont.truetype(font_path, size)
+        ascent, descent = font.getmetrics()
+        entries = [(char, render_glyph(font, char)) for char in sorted(charset)]
+        index = np.zeros(len(entries), dtype=FontPack.INDEX_DTYPE)
+        size_table[i] = (size, ascent, descent, 0, len(entries), offset)
+        offset += index.nbytes
+        indexes.append(index)
+        masks.append(entries)
+        print(f"[FontPack] {size}px: {len(entries)} glyphs")
+
+    with open(output + ".tmp", "wb") as f:
+        f.write(header.tobytes())
+        f.write(name_padded)
+        f.write(size_table.tobytes())
+        f.seek(offset)
+        for index, entries in zip(indexes, masks):
+            for j, (char, (mask, left, top, advance, height)) in enumerate(entries):
+                rows, width = mask.shape if mask is not None else (0, 0)
+                index[j] = (ord(char), advance, height, left, top, width, rows, offset)
+                if mask is not None:
+                    f.write(mask.tobytes())
+                    offset += mask.nbytes
+        f.seek(header.nbytes + len(name_padded) + size_table.nbytes)
+        for index in indexes:
+            f.write(index.tobytes())
+    os.replace(output + ".tmp", output)
+    print(f"[FontPack] Wrote {offset / 1024 / 1024:.1f} MB to {output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pre-render font glyphs into a memory-mappable font pack")
+    parser.add_argument("--font", default=DEFAULT_FONT)
+    parser.add_argument("--output", default="font_pack.bin")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES)
+    parser.add_argument("--charset-file", help="UTF-8 text file whose characters are added to the default charset")
+    args = parser.parse_args()
+    charset = default_charset()
+    if args.charset_file:
+        with open(args.charset_file, encoding="utf-8") as f:
+            charset.update(char for char in f.read() if char.isprintable())
+    build_font_pack(args.font, args.output, args.sizes, charset)
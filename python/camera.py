@@ -26,6 +26,8 @@ class CameraThread(threading.Thread):
         return super().start()
 
     def run(self):
+        # The preview covers the whole screen, undo any hardware text scrolling
+        self.whisplay.set_scroll_start(0)
         while self.running and self.capture_image is None:
             start_time = time.time()
             frame = CameraThread.picam2.capture_array()
@@ -1,16 +1,29 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw
+import asyncio
 import os
 import time
-import socket
 import json
+import struct
 import sys
 import threading
 import signal
+import stat
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 # from whisplay import WhisplayBoard
 from whisplay import WhisplayBoard
 from camera import CameraThread
-from utils import ColorUtils, ImageUtils, TextUtils
+from utils import ColorUtils, EmojiUtils, FontUtils, ImageUtils, TextUtils
+from text_layout import TextLayout
+from scroller import TextScroller
+from image_loader import ImageLoader
+from display_state import DisplayStateStore
+from display_writer import DisplayWriter
+from pending_update import PendingUpdate
 
 scroll_thread = None
 scroll_stop_event = threading.Event()
@@ -20,158 +33,173 @@ emoji_font_size=40
 battery_font_size=13
 
 # Global variables
-current_status = "Hello"
-current_emoji = "😄"
-current_text = "Waiting for message..."
-current_battery_level = 100
-current_battery_color = ColorUtils.get_rgb255_from_any("#55FF00")
-current_scroll_top = 0
-current_scroll_speed = 6
-current_image_path = ""
-current_image = None
-camera_mode = False
+# What the screen shows; published as immutable snapshots, see display_state.py
+# Initial values come from the DisplayState defaults
+display_state = DisplayStateStore()
 camera_mode_button_press_time = 0
 camera_mode_button_release_time = 0
 camera_capture_image_path = ""
 camera_thread = None
-clients = {}
+render_thread = None
+display_writer = None
+# Socket server: one asyncio event loop serves every client and the timers
+event_loop = None
+clients = set()
+# Longest message accepted from a client
+MAX_MESSAGE_SIZE = 16 * 1024 * 1024
+# Clients start with newline-delimited JSON and can switch to frames of a
+# 4-byte big-endian payload length followed by a JSON or msgpack payload
+FRAMING_NDJSON = "ndjson"
+FRAMING_LENGTH_PREFIXED = "length-prefixed"
+FRAME_HEADER = struct.Struct(">I")
+# Messages are merged and applied once per frame tick; ACK_MODES are how a
+# client wants them acknowledged: right away, once per tick, or not at all
+INGEST_INTERVAL = 1 / 30
+ACK_MODES = ("each", "batch", "none")
+pending_update = None
+pending_update_handle = None
 
 class RenderThread(threading.Thread):
-    def __init__(self, whisplay, font_path, fps=30):
+    # Battery icon size, position and the margin kept around its cached sprite
+    BATTERY_WIDTH = 26
+    BATTERY_HEIGHT = 15
+    BATTERY_MARGIN_RIGHT = 20
+    BATTERY_SPRITE_PADDING = 4
+
+    def __init__(self, whisplay, font_path, fps=30, event_driven=True, hardware_scroll=False):
         super().__init__()
         self.whisplay = whisplay
         self.font_path = font_path
         self.fps = fps
+        # In event-driven mode the thread only renders when the display data
+        # changes and while the text is still scrolling
+        self.event_driven = event_driven
+        self.render_condition = threading.Condition()
+        self.render_requested = True
         self.render_init_screen()
         # Clear logo after 1 second and start running loop
         time.sleep(1)
         self.running = True
-        self.main_text_font = ImageFont.truetype(self.font_path, 20)
+        self.main_text_font = FontUtils.get_font(self.font_path, 20)
         self.main_text_line_height = self.main_text_font.getmetrics()[0] + self.main_text_font.getmetrics()[1]
-        self.text_cache_image = None
-        self.current_render_text = ""
+        self.text_layout = TextLayout(self.main_text_font, self.whisplay.LCD_WIDTH, self.whisplay.LCD_WIDTH - 20, self.main_text_line_height)
 
         # Initialize header image and draw object
         self.header_height = 88 + 10  # header + margin
         self.header_image = Image.new("RGBA", (self.whisplay.LCD_WIDTH, self.header_height), (0, 0, 0, 255))
         self.header_draw = ImageDraw.Draw(self.header_image)
+        # The header is only redrawn and sent when its inputs change
+        self.header_cache_key = None
+        self.header_pixels = None
+        self.battery_sprites = {}
+
+        # Text area below the header, optionally scrolled by the panel itself
+        self.text_scroller = TextScroller(self.whisplay, self.header_height, self.whisplay.LCD_HEIGHT - self.header_height, hardware_scroll=hardware_scroll)
+        self.render_mode = None
+        # Scroll offset of the main text, owned by the render thread
+        self.scroll_top = 0
+        self.text_generation = None
+        # Version of the display state the header was last checked against
+        self.state_version = None
+
+        # Images for image mode are decoded off the render thread
+        self.image_loader = ImageLoader(self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT, on_loaded=self.request_render)
+        self.image_loader.start()
+        self.shown_image_key = None
 
     def render_init_screen(self):
         # Display logo on startup
         logo_path = os.path.join("img", "logo.png")
         if os.path.exists(logo_path):
             logo_image = Image.open(logo_path).convert("RGBA")
-            logo_image = logo_image.resize((whisplay.LCD_WIDTH, whisplay.LCD_HEIGHT), Image.LANCZOS)
-            rgb565_data = ImageUtils.image_to_rgb565(logo_image, whisplay.LCD_WIDTH, whisplay.LCD_HEIGHT)
-            whisplay.set_backlight(100)
-            whisplay.draw_image(0, 0, whisplay.LCD_WIDTH, whisplay.LCD_HEIGHT, rgb565_data)
-
-    def render_frame(self, status, emoji, text, scroll_top, battery_level, battery_color):
-        global current_scroll_speed, current_image_path, current_image, camera_mode
-        if camera_mode:
+            logo_image = logo_image.resize((self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT), Image.LANCZOS)
+            rgb565_data = ImageUtils.image_to_rgb565(logo_image, self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT)
+            self.whisplay.set_backlight(100)
+            self.whisplay.draw_image(0, 0, self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT, rgb565_data)
+
+    def render_frame(self, state):
+        if state.camera_mode:
+            if self.render_mode != "camera":
+                self.render_mode = "camera"
+                # A text frame queued while the camera started may have moved
+                # the scroll pointer after the camera reset it; resetting here
+                # orders the reset after every frame this thread has queued
+                self.whisplay.set_scroll_start(0)
             return  # Skip rendering if in camera mode
-        if current_image_path not in [None, ""]:
-            # Try to load image from path
-            if current_image is not None:
-                rgb565_data = ImageUtils.image_to_rgb565(current_image, self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT)
-                self.whisplay.draw_image(0, 0, self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT, rgb565_data)
-            elif os.path.exists(current_image_path):
-                try:
-                    image = Image.open(current_image_path).convert("RGBA") # 1024x1024
-                    # crop center and resize to fit screen ratio
-                    img_w, img_h = image.size
-                    screen_ratio = self.whisplay.LCD_WIDTH / self.whisplay.LCD_HEIGHT
-                    img_ratio = img_w / img_h
-                    if img_ratio > screen_ratio:
-                        # crop width
-                        new_w = int(img_h * screen_ratio)
-                        left = (img_w - new_w) // 2
-                        image = image.crop((left, 0, left + new_w, img_h))
-                    else:
-                        # crop height
-                        new_h = int(img_w / screen_ratio)
-                        top = (img_h - new_h) // 2
-                        image = image.crop((0, top, img_w, top + new_h))
-                    image = image.resize((self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT), Image.LANCZOS)
-                    current_image = image
-                    rgb565_data = ImageUtils.image_to_rgb565(image, self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT)
+        if state.image_path not in [None, ""]:
+            if self.render_mode != "image":
+                self.render_mode = "image"
+                self.shown_image_key = None
+                self.whisplay.set_scroll_start(0)
+            # The image is decoded in the background, draw it once it is ready
+            loaded = self.image_loader.get(state.image_path)
+            if loaded is not None:
+                image_key, rgb565_data = loaded
+                if image_key != self.shown_image_key:
+                    self.shown_image_key = image_key
                     self.whisplay.draw_image(0, 0, self.whisplay.LCD_WIDTH, self.whisplay.LCD_HEIGHT, rgb565_data)
-                except Exception as e:
-                    print(f"[Render] Failed to load image {current_image_path}: {e}")
         else:
-            current_image = None
-
-            # clear header image
-            self.header_draw.rectangle((0, 0, self.whisplay.LCD_WIDTH, self.header_height), fill=(0, 0, 0, 255))
-
-            clock_font_size = 24
-            # clock_font = ImageFont.truetype(self.font_path, clock_font_size)
-
-            # current_time = time.strftime("%H:%M:%S")
-            # draw.text((self.whisplay.LCD_WIDTH // 2, self.whisplay.LCD_HEIGHT // 2), current_time, font=clock_font, fill=(255, 255, 255, 255))
-
-            # render header
-            self.render_header(self.header_image, self.header_draw, status, emoji, battery_level, battery_color)
-            self.whisplay.draw_image(0, 0, self.whisplay.LCD_WIDTH, self.header_height, ImageUtils.image_to_rgb565(self.header_image, self.whisplay.LCD_WIDTH, self.header_height))
+            if self.render_mode != "text":
+                self.render_mode = "text"
+                self.text_scroller.invalidate()
+                self.header_cache_key = None
+                self.state_version = None
+
+            # New text that does not continue the old one starts at the top
+            if state.text_generation != self.text_generation:
+                self.text_generation = state.text_generation
+                self.scroll_top = 0
+                self.text_layout.set_text(state.text)
+            elif len(state.text) > len(self.text_layout.text):
+                # Within one generation the text only grows, so the new part
+                # is appended without comparing the whole text again
+                self.text_layout.append(state.text[len(self.text_layout.text):], state.text)
+
+            header_key = (state.status, state.emoji, state.battery_level, state.battery_color)
+            if self.state_version != state.version and self.header_cache_key != header_key:
+                self.header_cache_key = header_key
+                # clear header image
+                self.header_draw.rectangle((0, 0, self.whisplay.LCD_WIDTH, self.header_height), fill=(0, 0, 0, 255))
+
+                clock_font_size = 24
+                # clock_font = FontUtils.get_font(self.font_path, clock_font_size)
+
+                # current_time = time.strftime("%H:%M:%S")
+                # draw.text((self.whisplay.LCD_WIDTH // 2, self.whisplay.LCD_HEIGHT // 2), current_time, font=clock_font, fill=(255, 255, 255, 255))
+
+                # render header
+                self.render_header(self.header_image, self.header_draw, *header_key)
+                self.header_pixels = ImageUtils.image_to_rgb565(self.header_image, self.whisplay.LCD_WIDTH, self.header_height)
+                self.whisplay.draw_image(0, 0, self.whisplay.LCD_WIDTH, self.header_height, self.header_pixels)
 
             # render main text area
             text_area_height = self.whisplay.LCD_HEIGHT - self.header_height
-            text_bg_image = Image.new("RGBA", (self.whisplay.LCD_WIDTH, text_area_height), (0, 0, 0, 255))
-            text_draw = ImageDraw.Draw(text_bg_image)
-            self.render_main_text(text_bg_image, text_area_height, text_draw, text, current_scroll_speed)
-            self.whisplay.draw_image(0, self.header_height, self.whisplay.LCD_WIDTH, text_area_height, ImageUtils.image_to_rgb565(text_bg_image, self.whisplay.LCD_WIDTH, text_area_height))
+            scroll_top = self.scroll_top
+            text_pixels = self.render_main_text(text_area_height, state.text, state.scroll_speed)
+            self.text_scroller.present(scroll_top, text_pixels)
+        self.state_version = state.version
 
 
 
-    def render_main_text(self, main_text_image, area_height, draw, text, scroll_speed=2):
-        global current_scroll_top
-        """Render main text content, wrap lines according to screen width, only display currently visible part"""
-        if not text:
-            return
-        # Use main text font
-        font = ImageFont.truetype(self.font_path, 20)
-        lines = TextUtils.wrap_text(draw, text, font, self.whisplay.LCD_WIDTH - 20)
-
-        # Line height
-        line_height = self.main_text_line_height
-
-        # Calculate currently visible lines
-        display_lines = []
-        render_y = 0
-        fin_show_lines = False
-        for i, line in enumerate(lines):
-            if (i + 1) * line_height >= current_scroll_top and i * line_height - current_scroll_top <= area_height:
-                display_lines.append(line)
-                fin_show_lines = True
-            elif fin_show_lines is False:
-                render_y += line_height
-
-        # render_text
-        render_text = "".join(display_lines)
-        if self.current_render_text != render_text:
-            self.current_render_text = render_text
-            show_text_image = Image.new("RGBA", (self.whisplay.LCD_WIDTH, render_y + len(display_lines) * line_height), (0, 0, 0, 255))
-            show_text_draw = ImageDraw.Draw(show_text_image)
-            for line in display_lines:
-                TextUtils.draw_mixed_text(show_text_draw, show_text_image, line, font, (10, render_y))
-                render_y += line_height
-            # Update cache image
-            self.text_cache_image = show_text_image
-        # Draw text_cache_image to main_text_image
-        main_text_image.paste(self.text_cache_image, (0, -current_scroll_top), self.text_cache_image)
+    def render_main_text(self, area_height, text, scroll_speed=2):
+        """Render main text content, wrap lines according to screen width, return the currently visible rows as RGB565"""
+        # Only the appended part of streamed text is wrapped again
+        layout = self.text_layout
+        layout.set_text(text)
+        text_pixels = layout.viewport(self.scroll_top, area_height)
 
         # Update scroll position
-        if scroll_speed > 0 and current_scroll_top < (len(lines) + 1) * line_height - area_height:
-            current_scroll_top += scroll_speed
+        if scroll_speed > 0 and self.scroll_top < layout.height + layout.line_height - area_height:
+            self.scroll_top += scroll_speed
+        return text_pixels
 
 
     def render_header(self, image, draw, status, emoji, battery_level, battery_color):
-        global current_status, current_emoji, current_battery_level, current_battery_color
         global status_font_size, emoji_font_size, battery_font_size
 
-        status_font = ImageFont.truetype(self.font_path, status_font_size)
-        emoji_font = ImageFont.truetype(self.font_path, emoji_font_size)
-        battery_font = ImageFont.truetype(self.font_path, battery_font_size)
+        status_font = FontUtils.get_font(self.font_path, status_font_size)
+        emoji_font = FontUtils.get_font(self.font_path, emoji_font_size)
+        battery_font = FontUtils.get_font(self.font_path, battery_font_size)
 
         image_width = self.whisplay.LCD_WIDTH
 
@@ -181,28 +209,44 @@ class RenderThread(threading.Thread):
         top_height = status_font_size + emoji_font_size + 20
 
         # Draw status centered
-        status_bbox = status_font.getbbox(current_status)
-        status_w = status_bbox[2] - status_bbox[0]
-        TextUtils.draw_mixed_text(draw, image, current_status, status_font, (self.whisplay.CornerHeight, 0))
+        TextUtils.draw_mixed_text(draw, image, status, status_font, (self.whisplay.CornerHeight, 0))
 
-        # Draw emoji centered
-        emoji_bbox = emoji_font.getbbox(current_emoji)
-        emoji_w = emoji_bbox[2] - emoji_bbox[0]
-        TextUtils.draw_mixed_text(draw, image, current_emoji, emoji_font, ((image_width - emoji_w) // 2, status_font_size + 8))
+        # Draw emoji centered (measured from the glyph atlas, so a packed
+        # font never has to load FreeType)
+        emoji_w = TextUtils.get_line_img(emoji, emoji_font).width
+        TextUtils.draw_mixed_text(draw, image, emoji, emoji_font, ((image_width - emoji_w) // 2, status_font_size + 8))
 
         # Draw battery icon
         if battery_level is not None:
-            self.render_battery(draw, battery_font, battery_level, battery_color, image_width, status_font_size)
+            self.render_battery(image, battery_font, battery_level, battery_color, image_width, status_font_size)
 
         return top_height
 
-    def render_battery(self, draw, battery_font, battery_level, battery_color, image_width, status_font_size):
-         # Battery icon parameters (smaller)
-        battery_width = 26
-        battery_height = 15
-        battery_margin_right = 20
-        battery_x = image_width - battery_width - battery_margin_right
+    def render_battery(self, image, battery_font, battery_level, battery_color, image_width, status_font_size):
+        battery_x = image_width - self.BATTERY_WIDTH - self.BATTERY_MARGIN_RIGHT
         battery_y = (status_font_size) // 2
+        sprite = self.get_battery_sprite(battery_font, battery_level, battery_color)
+        padding = self.BATTERY_SPRITE_PADDING
+        image.paste(sprite, (battery_x - padding, battery_y - padding))
+
+    def get_battery_sprite(self, battery_font, battery_level, battery_color):
+        """Battery icon on a black background, cached per (level, color)"""
+        cache_key = (battery_level, battery_color)
+        sprite = self.battery_sprites.get(cache_key)
+        if sprite is None:
+            if len(self.battery_sprites) >= 64:
+                self.battery_sprites.clear()
+            padding = self.BATTERY_SPRITE_PADDING
+            sprite = Image.new("RGBA", (self.BATTERY_WIDTH + 3 + 2 * padding, self.BATTERY_HEIGHT + 1 + 2 * padding), (0, 0, 0, 255))
+            self.draw_battery(sprite, battery_font, battery_level, battery_color, padding, padding)
+            self.battery_sprites[cache_key] = sprite
+        return sprite
+
+    def draw_battery(self, image, battery_font, battery_level, battery_color, battery_x, battery_y):
+        draw = ImageDraw.Draw(image)
+         # Battery icon parameters (smaller)
+        battery_width = self.BATTERY_WIDTH
+        battery_height = self.BATTERY_HEIGHT
         corner_radius = 3
         fill_color = "black"
         if battery_color is not None:
@@ -237,11 +281,9 @@ class RenderThread(threading.Thread):
 
         # Battery level text (just number)
         battery_text = str(battery_level)
-        text_bbox = battery_font.getbbox(battery_text)
-        text_h = text_bbox[3] - text_bbox[1]
-        text_y = battery_y + (battery_height - (battery_font.getmetrics()[0] + battery_font.getmetrics()[1])) // 2
-        text_w = text_bbox[2] - text_bbox[0]
-        text_x = battery_x + (battery_width - text_w) // 2
+        text_img = TextUtils.get_line_img(battery_text, battery_font)
+        text_y = battery_y + (battery_height - text_img.height) // 2
+        text_x = battery_x + (battery_width - text_img.width) // 2
 
         luminance = ColorUtils.calculate_luminance(fill_color)
         brightness_threshold = 128 # You can adjust this threshold as needed
@@ -249,74 +291,250 @@ class RenderThread(threading.Thread):
             text_fill_color = "black"
         else:
             text_fill_color = "white"
-        draw.text((text_x, text_y), battery_text, font=battery_font, fill=text_fill_color)
+        # The line image is white text, use its alpha to draw in the chosen color
+        image.paste(text_fill_color, (text_x, text_y), text_img)
+
+    def request_render(self):
+        """Wake the render loop to draw a new frame"""
+        with self.render_condition:
+            self.render_requested = True
+            self.render_condition.notify()
 
     def run(self):
         frame_interval = 1 / self.fps
         while self.running:
-            self.render_frame(current_status, current_emoji, current_text, current_scroll_top, current_battery_level, current_battery_color)
-            time.sleep(frame_interval)
+            with self.render_condition:
+                self.render_requested = False
+            # One snapshot per frame, so a frame never mixes old and new data
+            state = display_state.get()
+            scroll_top_before = self.scroll_top
+            self.render_frame(state)
+            is_scrolling = self.scroll_top != scroll_top_before
+            if not self.event_driven or is_scrolling:
+                time.sleep(frame_interval)
+                continue
+            with self.render_condition:
+                while self.running and not self.render_requested:
+                    self.render_condition.wait()
 
     def stop(self):
-        self.running = False
+        with self.render_condition:
+            self.running = False
+            self.render_condition.notify()
 
 def update_display_data(status=None, emoji=None, text=None,
-                  scroll_speed=None, battery_level=None, battery_color=None, image_path=None):
-    global current_status, current_emoji, current_text, current_battery_level
-    global current_battery_color, current_scroll_top, current_scroll_speed, current_image_path
-
-    # If text is not continuation of previous, reset scroll position
-    if text is not None and not text.startswith(current_text):
-        current_scroll_top = 0
-        TextUtils.clean_line_image_cache()
-    if scroll_speed is not None:
-        current_scroll_speed = scroll_speed
-    current_status = status if status is not None else current_status
-    current_emoji = emoji if emoji is not None else current_emoji
-    current_text = text if text is not None else current_text
-    current_battery_level = battery_level if battery_level is not None else current_battery_level
-    current_battery_color = battery_color if battery_color is not None else current_battery_color
-    current_image_path = image_path if image_path is not None else current_image_path
+                  scroll_speed=None, battery_level=None, battery_color=None, image_path=None,
+                  text_append=None, text_seq=None, text_seq_end=None):
+    """Publish the given fields. `text_append` is added to the current text if
+    `text_seq` directly follows the sequence number of the current text;
+    returns False when it does not and the append was dropped. When several
+    appends are merged, `text_seq_end` is the number of the last one."""
+    accepted = True
+
+    def build_changes(state):
+        nonlocal accepted
+        changes = {}
+        if text_append is not None:
+            if state.text_seq is None or text_seq != state.text_seq + 1:
+                accepted = False
+            else:
+                changes["text"] = state.text + text_append
+                changes["text_seq"] = text_seq_end if text_seq_end is not None else text_seq
+        elif text is not None:
+            # If text is not continuation of previous, reset scroll position
+            if not text.startswith(state.text):
+                changes["text_generation"] = state.text_generation + 1
+            changes["text"] = text
+            changes["text_seq"] = text_seq
+        if scroll_speed is not None:
+            changes["scroll_speed"] = scroll_speed
+        if status is not None:
+            changes["status"] = status
+        if emoji is not None:
+            changes["emoji"] = emoji
+        if battery_level is not None:
+            changes["battery_level"] = battery_level
+        if battery_color is not None:
+            changes["battery_color"] = battery_color
+        if image_path is not None:
+            changes["image_path"] = image_path
+        return changes
+
+    version = display_state.get().version
+    # Repeated identical updates publish no new version and need no frame
+    if display_state.modify(build_changes).version != version:
+        request_render()
+    return accepted
+
+
+def request_render():
+    if render_thread is not None:
+        render_thread.request_render()
+
+
+def call_later(delay, callback, blocking=False):
+    """Run `callback` on the server event loop after `delay` seconds, safe to
+    call from any thread. Callbacks that block (e.g. stopping the camera) are
+    run on the loop's executor so other clients are not held up."""
+    if event_loop is None:
+        return
+    if blocking:
+        target = lambda: event_loop.run_in_executor(None, callback)
+    else:
+        target = callback
+    event_loop.call_soon_threadsafe(event_loop.call_later, delay, target)
+
+
+class ClientConnection:
+    """State of one connected client.
+
+    A client starts in newline-delimited JSON mode. Sending
+    {"framing": "length-prefixed", "codec": "json" | "msgpack"} switches both
+    directions to length-prefixed frames; the server confirms with a
+    "framing" event (the last newline-delimited message) and falls back to
+    JSON when msgpack is not installed. In framed mode acknowledgements and
+    errors are sent as {"ok": true} and {"error": "..."}. The same request
+    (or {"acks": ...} alone) can set the acknowledgement mode to "each"
+    (default), "batch" or "none".
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Unix socket peers are unnamed, so fall back to the listening path
+        self.addr = writer.get_extra_info("peername") or f"unix:{writer.get_extra_info('sockname')}"
+        self.framing = FRAMING_NDJSON
+        self.codec = "json"
+        self.ack_mode = "each"
+        # Received bytes not yet parsed into frames
+        self.buffer = bytearray()
+
+    async def read_messages(self):
+        """Return the raw payloads of the next received messages, None at EOF"""
+        if self.framing == FRAMING_NDJSON:
+            # StreamReader keeps one buffer and only scans the new bytes for
+            # the separator, so a burst of lines is handled in linear time
+            line = await self.reader.readline()
+            if not line:
+                return None
+            line = line.strip()
+            return [line] if line else []
+        data = await self.reader.read(65536)
+        if not data:
+            return None
+        self.buffer += data
+        payloads = []
+        offset = 0
+        with memoryview(self.buffer) as view:
+            while len(view) - offset >= FRAME_HEADER.size:
+                (length,) = FRAME_HEADER.unpack_from(view, offset)
+                if length > MAX_MESSAGE_SIZE:
+                    raise ValueError(f"frame of {length} bytes exceeds the limit")
+                start = offset + FRAME_HEADER.size
+                if len(view) - start < length:
+                    break
+                payloads.append(bytes(view[start:start + length]))
+                offset = start + length
+        del self.buffer[:offset]
+        return payloads
+
+    def decode(self, payload):
+        # Payloads are decoded only once complete, so multi-byte characters
+        # split across reads are never decoded in halves
+        if self.codec == "msgpack":
+            return msgpack.unpackb(payload, raw=False)
+        return json.loads(payload)
+
+    def negotiate(self, content):
+        """Handle a framing request from the client"""
+        framing = content.get("framing")
+        if framing != FRAMING_LENGTH_PREFIXED:
+            framing = FRAMING_NDJSON
+        codec = "msgpack" if content.get("codec") == "msgpack" and msgpack is not None else "json"
+        ack_mode = content.get("acks", self.ack_mode)
+        if ack_mode not in ACK_MODES:
+            ack_mode = "each"
+        self.send_message({"event": "framing", "framing": framing, "codec": codec, "acks": ack_mode})
+        self.framing = framing
+        self.codec = codec if framing == FRAMING_LENGTH_PREFIXED else "json"
+        self.ack_mode = ack_mode
+        print(f"[Socket - {self.addr}] Using {self.framing} framing with {self.codec} payloads, acks: {self.ack_mode}")
+
+    def send(self, data):
+        """Queue raw bytes for the client; must be called on the event loop"""
+        if not self.writer.is_closing():
+            self.writer.write(data)
+
+    def send_message(self, message):
+        if self.framing == FRAMING_NDJSON:
+            self.send(json.dumps(message).encode("utf-8") + b"\n")
+            return
+        if self.codec == "msgpack":
+            payload = msgpack.packb(message)
+        else:
+            payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+        self.send(FRAME_HEADER.pack(len(payload)) + payload)
+
+    def send_ack(self, count=1):
+        """Acknowledge `count` messages with one write"""
+        if self.framing == FRAMING_NDJSON:
+            self.send(b"OK\n" * count)
+        elif count == 1:
+            self.send_message({"ok": True})
+        else:
+            self.send_message({"ok": True, "count": count})
+
+    def send_error(self, error):
+        if self.framing == FRAMING_NDJSON:
+            self.send(f"ERROR: {error}\n".encode("utf-8"))
+        else:
+            self.send_message({"error": error})
 
 
 def send_to_all_clients(message):
-    """Send message to all connected clients"""
-    message_json = json.dumps(message).encode("utf-8") + b"\n"
-    for addr, client_socket in clients.items():
+    """Send message to all connected clients, from any thread"""
+    if event_loop is not None:
+        event_loop.call_soon_threadsafe(broadcast, message)
+
+
+def broadcast(message):
+    message_json = json.dumps(message)
+    for client in list(clients):
         try:
-            client_socket.sendall(message_json)
+            client.send_message(message)
             # Use ellipsis for long messages
             if len(message_json) > 100:
-                display_message = message_json[:50] + b"..." + message_json[-50:]
+                display_message = message_json[:50] + "..." + message_json[-50:]
             else:
                 display_message = message_json
-            print(f"[Server] Sent notification to client {addr}: {display_message}")
+            print(f"[Server] Sent notification to client {client.addr}: {display_message}")
         except Exception as e:
-            print(f"[Server] Failed to send notification to client {addr}: {e}")
+            print(f"[Server] Failed to send notification to client {client.addr}: {e}")
 
 def exit_camera_mode():
-    global camera_mode, camera_thread
+    global camera_thread
     print("[Camera] Exiting camera mode...")
     if camera_thread is not None:
         camera_thread.stop()
         camera_thread = None
     notification = {"event": "exit_camera_mode"}
     send_to_all_clients(notification)
-    camera_mode = False
+    display_state.update(camera_mode=False)
+    request_render()
 
 def check_is_released():
-    global camera_mode, camera_mode_button_press_time, camera_mode_button_release_time, camera_thread
-    if camera_mode and camera_mode_button_release_time < camera_mode_button_press_time:
+    global camera_mode_button_press_time, camera_mode_button_release_time, camera_thread
+    if display_state.get().camera_mode and camera_mode_button_release_time < camera_mode_button_press_time:
         # long press detected, exit camera mode
         print("[Camera] Exiting camera mode due to long press...")
         exit_camera_mode()
 
 def on_button_pressed():
-    global camera_mode, camera_mode_button_press_time, camera_mode_button_release_time
-    if camera_mode:
+    global camera_mode_button_press_time, camera_mode_button_release_time
+    if display_state.get().camera_mode:
         camera_mode_button_press_time = time.time()
         # check after 2 seconds, exit camera mode if not released
-        threading.Timer(2.0, check_is_released).start()
+        call_later(2.0, check_is_released, blocking=True)
         return
     """Function executed when button is pressed"""
     print("[Server] Button pressed")
@@ -324,8 +542,8 @@ def on_button_pressed():
     send_to_all_clients(notification)
 
 def on_button_release():
-    global camera_mode, camera_mode_button_press_time, camera_mode_button_release_time
-    if camera_mode:
+    global camera_mode_button_press_time, camera_mode_button_release_time
+    if display_state.get().camera_mode:
         camera_mode_button_release_time = time.time()
         # if single press and release within 2 seconds
         if camera_mode_button_release_time - camera_mode_button_press_time <= 2:
@@ -336,7 +554,7 @@ def on_button_release():
                 notification = {"event": "camera_capture"}
                 send_to_all_clients(notification)
                 # exit camera mode in 2 seconds after capture
-                threading.Timer(2.0, exit_camera_mode).start()
+                call_later(2.0, exit_camera_mode, blocking=True)
 
         return  # Ignore button presses in camera mode
     """Function executed when button is released"""
@@ -344,135 +562,239 @@ def on_button_release():
     notification = {"event": "button_released"}
     send_to_all_clients(notification)
 
-def handle_client(client_socket, addr, whisplay):
-    global camera_capture_image_path, camera_mode, camera_thread
-    print(f"[Socket] Client {addr} connected")
-    clients[addr] = client_socket
+async def handle_message(client, content):
+    """Apply one message from a client"""
+    global camera_capture_image_path, camera_thread
+    transaction_id = content.get("transaction_id", None)
+    status = content.get("status", None)
+    emoji = content.get("emoji", None)
+    text = content.get("text", None)
+    # Streamed text: text_append carries only the new part, text_replace the
+    # whole text; both are numbered by text_seq
+    text_append = content.get("text_append", None)
+    text_replace = content.get("text_replace", None)
+    text_seq = content.get("text_seq", None)
+    if text_replace is not None:
+        text = text_replace
+    rgbled = content.get("RGB", None)
+    brightness = content.get("brightness", None)
+    scroll_speed = content.get("scroll_speed", 2)
+    response_to_client = content.get("response", None)
+    battery_level = content.get("battery_level", None)
+    battery_color = content.get("battery_color", None)
+    image_path = content.get("image", None)
+    capture_image_path = content.get("capture_image_path", None)
+    # boolean to enable camera mode
+    set_camera_mode = content.get("camera_mode", None)
+
+    if battery_color:
+        battery_tuple = ColorUtils.get_rgb255_from_any(battery_color)
+    else:
+        battery_tuple = (0, 0, 0)
+
+    if capture_image_path is not None:
+        camera_capture_image_path = capture_image_path
+
+    if set_camera_mode is not None:
+        # Opening and stopping the camera block, keep them off the event loop
+        if set_camera_mode:
+            print("[Camera] Entering camera mode...")
+            display_state.update(camera_mode=True)
+            request_render()
+            camera_thread = await asyncio.to_thread(CameraThread, display_writer, camera_capture_image_path)
+            camera_thread.start()
+        else:
+            print("[Camera] Exiting camera mode...")
+            if camera_thread is not None:
+                await asyncio.to_thread(camera_thread.stop)
+                camera_thread = None
+            display_state.update(camera_mode=False)
+            request_render()
+
+    # Display and LED changes are merged until the next frame tick
+    update = get_pending_update()
+    if rgbled:
+        update.set(rgb=ColorUtils.get_rgb255_from_any(rgbled))
+    if brightness:
+        update.set(brightness=brightness)
+    if (text is not None) or (text_append is not None) or (status is not None) or (emoji is not None) or \
+       (battery_level is not None) or (battery_color is not None) or \
+       (image_path is not None):
+        update.set(status=status, emoji=emoji, scroll_speed=scroll_speed,
+                   battery_level=battery_level, battery_color=battery_tuple, image_path=image_path)
+        if text_append is not None:
+            if not update.append_text(text_append, text_seq, client):
+                # Not a continuation of the pending text, apply that first
+                flush_updates()
+                update = get_pending_update()
+                update.append_text(text_append, text_seq, client)
+        elif text is not None:
+            update.replace_text(text, text_seq)
+
+    if client.ack_mode == "each":
+        client.send_ack()
+    elif client.ack_mode == "batch":
+        update.add_ack(client)
+    if response_to_client:
+        try:
+            client.send_message({"response": response_to_client})
+            print(f"[Socket - {client.addr}] Sent response: {response_to_client}")
+        except Exception as e:
+            print(f"[Socket - {client.addr}] Response sending error: {e}")
+
+def get_pending_update():
+    """Return the update being collected for the next tick, scheduling the tick"""
+    global pending_update, pending_update_handle
+    if pending_update is None:
+        pending_update = PendingUpdate()
+        pending_update_handle = event_loop.call_later(INGEST_INTERVAL, flush_updates)
+    return pending_update
+
+def flush_updates():
+    """Apply the merged update: LED, backlight, display state, then acks"""
+    global pending_update, pending_update_handle
+    update = pending_update
+    if update is None:
+        return
+    pending_update = None
+    pending_update_handle.cancel()
+    pending_update_handle = None
+
+    fields = update.fields
+    if "rgb" in fields:
+        whisplay.set_rgb_fade(*fields["rgb"], duration_ms=500)
+    if "brightness" in fields:
+        whisplay.set_backlight(fields["brightness"])
+
+    display_fields = {name: fields.get(name) for name in
+                      ("status", "emoji", "scroll_speed", "battery_level", "battery_color", "image_path")}
+    if any(value is not None for value in display_fields.values()) or update.text_parts is not None:
+        if update.is_append:
+            text_fields = {"text_append": update.text, "text_seq": update.text_seq, "text_seq_end": update.text_seq_end}
+        else:
+            # Appends merged onto a replacement leave it numbered by the last one
+            text_fields = {"text": update.text, "text_seq": update.text_seq_end}
+        accepted = update_display_data(**display_fields, **text_fields)
+        if not accepted:
+            # The clients' text is out of step with ours, ask for the full text
+            current_seq = display_state.get().text_seq
+            for client in update.text_clients:
+                print(f"[Socket - {client.addr}] Text append {update.text_seq} out of sequence (current {current_seq}), requesting resync")
+                client.send_message({"event": "text_resync", "text_seq": current_seq})
+
+    for client, count in update.acks.items():
+        client.send_ack(count)
+
+async def handle_client(reader, writer):
+    client = ClientConnection(reader, writer)
+    print(f"[Socket] Client {client.addr} connected")
+    clients.add(client)
     try:
-        buffer = ""
         while True:
-            data = client_socket.recv(4096).decode("utf-8")
-            if not data:
+            payloads = await client.read_messages()
+            if payloads is None:
                 break
-            buffer += data
-
-            while "\n" in buffer:
-                line, buffer = buffer.split("\n", 1)
-                if not line.strip():
-                    continue
 
-                # print(f"[Socket - {addr}] Received data: {line}")
+            for payload in payloads:
+                # print(f"[Socket - {client.addr}] Received data: {payload}")
                 try:
-                    content = json.loads(line)
-                    transaction_id = content.get("transaction_id", None)
-                    status = content.get("status", None)
-                    emoji = content.get("emoji", None)
-                    text = content.get("text", None)
-                    rgbled = content.get("RGB", None)
-                    brightness = content.get("brightness", None)
-                    scroll_speed = content.get("scroll_speed", 2)
-                    response_to_client = content.get("response", None)
-                    battery_level = content.get("battery_level", None)
-                    battery_color = content.get("battery_color", None)
-                    image_path = content.get("image", None)
-                    capture_image_path = content.get("capture_image_path", None)
-                    # boolean to enable camera mode
-                    set_camera_mode = content.get("camera_mode", None)
-
-                    if rgbled:
-                        rgb255_tuple = ColorUtils.get_rgb255_from_any(rgbled)
-                        whisplay.set_rgb_fade(*rgb255_tuple, duration_ms=500)
-
-                    if battery_color:
-                        battery_tuple = ColorUtils.get_rgb255_from_any(battery_color)
-                    else:
-                        battery_tuple = (0, 0, 0)
-
-                    if brightness:
-                        whisplay.set_backlight(brightness)
-
-                    if capture_image_path is not None:
-                        camera_capture_image_path = capture_image_path
-
-                    if set_camera_mode is not None:
-                        if set_camera_mode:
-                            print("[Camera] Entering camera mode...")
-                            camera_mode = True
-                            camera_thread = CameraThread(whisplay, camera_capture_image_path)
-                            camera_thread.start()
-                        else:
-                            print("[Camera] Exiting camera mode...")
-                            if camera_thread is not None:
-                                camera_thread.stop()
-                                camera_thread = None
-                            camera_mode = False
-
-                    if (text is not None) or (status is not None) or (emoji is not None) or \
-                       (battery_level is not None) or (battery_color is not None) or \
-                       (image_path is not None):
-                        update_display_data(status=status, emoji=emoji,
-                                     text=text, scroll_speed=scroll_speed,
-                                     battery_level=battery_level, battery_color=battery_tuple,
-                                     image_path=image_path)
-
-                    client_socket.send(b"OK\n")
-                    if response_to_client:
-                        try:
-                            response_bytes = json.dumps({"response": response_to_client}).encode("utf-8") + b"\n"
-                            client_socket.send(response_bytes)
-                            print(f"[Socket - {addr}] Sent response: {response_to_client}")
-                        except Exception as e:
-                            print(f"[Socket - {addr}] Response sending error: {e}")
-
+                    content = client.decode(payload)
+                    if client.framing == FRAMING_NDJSON and ("framing" in content or "acks" in content):
+                        client.negotiate(content)
+                        continue
+                    await handle_message(client, content)
                 except json.JSONDecodeError:
-                    client_socket.send(b"ERROR: invalid JSON\n")
+                    client.send_error("invalid JSON")
                 except Exception as e:
-                    print(f"[Socket - {addr}] Data processing error: {e}")
-                    client_socket.send(f"ERROR: {e}\n".encode("utf-8"))
+                    print(f"[Socket - {client.addr}] Data processing error: {e}")
+                    client.send_error(str(e))
+            await writer.drain()
 
     except Exception as e:
-        print(f"[Socket - {addr}] Connection error: {e}")
+        print(f"[Socket - {client.addr}] Connection error: {e}")
+    finally:
+        print(f"[Socket] Client {client.addr} disconnected")
+        clients.discard(client)
+        writer.close()
+
+def remove_socket_file(path):
+    """Remove the Unix socket at `path`; refuses to delete anything else, in
+    case WHISPLAY_DISPLAY_SOCKET points at the wrong file"""
+    try:
+        mode = os.lstat(path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise FileExistsError(f"{path} exists and is not a Unix socket, set WHISPLAY_DISPLAY_SOCKET to another path")
+    os.unlink(path)
+
+async def serve(host, port, unix_path=None):
+    """Accept clients over TCP on host:port and/or on the Unix socket at
+    `unix_path`; both transports share the same client handling"""
+    servers = []
+    if unix_path:
+        # A socket file left by a previous run would make bind() fail; checked
+        # first so a wrong path fails before anything is listening
+        remove_socket_file(unix_path)
+    if host is not None:
+        servers.append(await asyncio.start_server(handle_client, host, port, limit=MAX_MESSAGE_SIZE))
+        print(f"[Socket] Listening on {host}:{port} ...")
+    if unix_path:
+        servers.append(await asyncio.start_unix_server(handle_client, unix_path, limit=MAX_MESSAGE_SIZE))
+        print(f"[Socket] Listening on {unix_path} ...")
+    if not servers:
+        raise ValueError("No transport to listen on, set a TCP host or a Unix socket path")
+    try:
+        await asyncio.gather(*(server.serve_forever() for server in servers))
     finally:
-        print(f"[Socket] Client {addr} disconnected")
-        del clients[addr]
-        client_socket.close()
+        for server in servers:
+            server.close()
+        if unix_path:
+            remove_socket_file(unix_path)
 
-def start_socket_server(render_thread, host='0.0.0.0', port=12345):
+def start_socket_server(render_thread, host='0.0.0.0', port=12345, unix_path=None):
+    global event_loop
     # Register button events
     whisplay.on_button_press(on_button_pressed)
     whisplay.on_button_release(on_button_release)
 
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((host, port))
-    server_socket.listen(5)  # Allow more connections
-    print(f"[Socket] Listening on {host}:{port} ...")
-
+    event_loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(event_loop)
     try:
-        while True:
-            client_socket, addr = server_socket.accept()
-            client_thread = threading.Thread(target=handle_client,
-                                           args=(client_socket, addr, whisplay))
-            client_thread.daemon = True
-            client_thread.start()
+        event_loop.run_until_complete(serve(host, port, unix_path))
     except KeyboardInterrupt:
         print("[Socket] Server stopped")
     finally:
         render_thread.stop()
-        server_socket.close()
+        event_loop.close()
 
 
 if __name__ == "__main__":
     whisplay = WhisplayBoard()
     print(f"[LCD] Initialization finished: {whisplay.LCD_WIDTH}x{whisplay.LCD_HEIGHT}")
+    print(f"[Emoji] Mapped {EmojiUtils.load_emoji_atlas()} pre-rendered emoji sprites")
+    print(f"[Emoji] Indexed {EmojiUtils.load_emoji_index()} emoji SVGs")
+    font_pack = FontUtils.load_font_pack()
+    if font_pack is not None:
+        print(f"[Font] Mapped font pack for {font_pack.source} at sizes {sorted(font_pack.sizes)}")
+    # SPI transfers run on their own thread so rendering and sending overlap
+    display_writer = DisplayWriter(whisplay)
+    display_writer.start()
     # start render thread
-    render_thread = RenderThread(whisplay, "NotoSansSC-Bold.ttf", fps=30)
+    hardware_scroll = os.environ.get("WHISPLAY_HARDWARE_SCROLL", "").lower() == "true"
+    render_thread = RenderThread(display_writer, "NotoSansSC-Bold.ttf", fps=30, hardware_scroll=hardware_scroll)
     render_thread.start()
-    start_socket_server(render_thread, host='0.0.0.0', port=12345)
+    # A Unix socket skips the TCP/IP stack for the local client; TCP stays
+    # available unless WHISPLAY_DISPLAY_TCP=false
+    unix_path = os.environ.get("WHISPLAY_DISPLAY_SOCKET") or None
+    tcp_enabled = os.environ.get("WHISPLAY_DISPLAY_TCP", "").lower() != "false"
+    start_socket_server(render_thread, host='0.0.0.0' if tcp_enabled or not unix_path else None,
+                        port=12345, unix_path=unix_path)
 
     def cleanup_and_exit(signum, frame):
         print("[System] Exiting...")
         render_thread.stop()
+        display_writer.stop()
         whisplay.cleanup()
         sys.exit(0)
 
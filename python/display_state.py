@@ -0,0 +1,65 @@
+import threading
+from typing import NamedTuple, Optional, Tuple
+
+
+class DisplayState(NamedTuple):
+    """Immutable snapshot of everything the render thread draws.
+
+    `version` grows by one with every published change, so a reader can tell
+    whether anything changed by comparing a single integer. `text_generation`
+    grows when the text is replaced by one that is not a continuation of the
+    previous text, which tells the renderer to scroll back to the top.
+    `text_seq` is the sequence number of the last `text_append`/`text_replace`
+    message the text reflects, or None when it was set without one.
+    """
+
+    version: int = 0
+    status: str = "Hello"
+    emoji: str = "😄"
+    text: str = "Waiting for message..."
+    text_generation: int = 0
+    text_seq: Optional[int] = None
+    scroll_speed: int = 6
+    battery_level: Optional[int] = 100
+    battery_color: Tuple[int, int, int] = (0x55, 0xFF, 0x00)
+    image_path: str = ""
+    camera_mode: bool = False
+
+
+class DisplayStateStore:
+    """Holds the current DisplayState and publishes new snapshots atomically.
+
+    Writers (socket handlers, button callbacks) build the next snapshot under a
+    lock and swap the reference; readers take one reference with `get()` and
+    work on it without locking, so a frame never mixes old and new fields.
+    """
+
+    def __init__(self, state=None):
+        self.state = state if state is not None else DisplayState()
+        self.lock = threading.Lock()
+
+    def get(self):
+        return self.state
+
+    def update(self, **changes):
+        """Publish a snapshot with `changes` applied"""
+        return self.modify(lambda state: changes)
+
+    def modify(self, build_changes):
+        """Publish a snapshot with the changes returned by `build_changes(state)`.
+
+        `build_changes` runs under the lock, so changes that depend on the
+        current state (e.g. comparing the new text to the old) are atomic.
+        Fields that keep their value are dropped; when nothing changes no new
+        version is published.
+        """
+        with self.lock:
+            state = self.state
+            changes = {
+                name: value for name, value in build_changes(state).items()
+                if getattr(state, name) != value
+            }
+            if not changes:
+                return state
+            self.state = state._replace(version=state.version + 1, **changes)
+            return self.state
@@ -0,0 +1,145 @@
+import threading
+from collections import deque
+
+import numpy as np
+
+
+class DisplayWriter(threading.Thread):
+    """Sends drawing operations to the panel from a dedicated thread.
+
+    Drop-in stand-in for the WhisplayBoard drawing calls: `draw_image`,
+    `fill_screen`, `draw_pixel`, `draw_line`, `define_scroll_area`,
+    `set_scroll_start` and `configure_dirty_tracking` are queued and return
+    immediately, so the next frame can be rendered while the previous one is
+    still going out over SPI. Members that never touch the SPI bus
+    (backlight, RGB LED, buttons, panel size, stats) are passed straight to
+    the board; anything else is not available, so no SPI traffic can run
+    beside the writer thread.
+
+    The queue is bounded. A queued `draw_image` is dropped when a newer one
+    covers the same rectangle before any ordered operation (scroll or fill)
+    in between, so when the renderer or the camera gets ahead only the latest
+    pixels are sent. If the queue is still full the caller waits.
+    """
+
+    MAX_PENDING = 16
+    PASSTHROUGH = frozenset((
+        "LCD_WIDTH", "LCD_HEIGHT", "CornerHeight", "FRAME_MEMORY_ROWS", "ROW_OFFSET",
+        "set_backlight", "set_rgb", "set_rgb_fade",
+        "button_pressed", "on_button_press", "on_button_release",
+        "get_spi_stats",
+    ))
+
+    def __init__(self, whisplay, max_pending=MAX_PENDING):
+        self.whisplay = whisplay
+        super().__init__(daemon=True)
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.running = True
+        self.busy = False
+        # Scroll state as it will be once the queue is drained, so callers
+        # (e.g. TextScroller) can plan the next frame without waiting
+        self.scroll_area = whisplay.scroll_area
+        self.scroll_start = whisplay.scroll_start
+        self.ops_queued = 0
+        self.draws_dropped = 0
+
+    def __getattr__(self, name):
+        if name in DisplayWriter.PASSTHROUGH:
+            return getattr(self.whisplay, name)
+        raise AttributeError(f"{type(self).__name__} does not pass {name!r} to the board")
+
+    # ========== Queued drawing ==========
+    def draw_image(self, x, y, width, height, pixel_data):
+        if (x + width > self.whisplay.LCD_WIDTH) or (y + height > self.whisplay.LCD_HEIGHT):
+            raise ValueError("Image size exceeds screen bounds")
+        # The caller may reuse its buffer (e.g. a view into the text strip)
+        if isinstance(pixel_data, np.ndarray):
+            pixel_data = pixel_data.copy()
+        elif not isinstance(pixel_data, bytes):
+            pixel_data = bytes(pixel_data)
+        self._enqueue((x, y, width, height), self.whisplay.draw_image, (x, y, width, height, pixel_data))
+
+    def fill_screen(self, color):
+        self._enqueue(None, self.whisplay.fill_screen, (color,))
+
+    def draw_pixel(self, x, y, color):
+        self._enqueue(None, self.whisplay.draw_pixel, (x, y, color))
+
+    def draw_line(self, x0, y0, x1, y1, color):
+        self._enqueue(None, self.whisplay.draw_line, (x0, y0, x1, y1, color))
+
+    def configure_dirty_tracking(self, enabled=True, full_refresh_ratio=None, max_rects=None):
+        # Queued so it applies from the next queued draw on, not mid-transfer
+        self._enqueue(None, self.whisplay.configure_dirty_tracking, (enabled, full_refresh_ratio, max_rects))
+
+    def define_scroll_area(self, top, height):
+        self.scroll_area = (top, height)
+        self.scroll_start = 0
+        self._enqueue(None, self.whisplay.define_scroll_area, (top, height))
+
+    def set_scroll_start(self, row):
+        if self.scroll_area is None or row == self.scroll_start:
+            return
+        self.scroll_start = row
+        self._enqueue(None, self.whisplay.set_scroll_start, (row,))
+
+    def _enqueue(self, rect, func, args):
+        with self.condition:
+            if rect is not None:
+                self._drop_covered(rect)
+            while self.running and len(self.pending) >= self.max_pending:
+                self.condition.wait()
+            self.pending.append((rect, func, args))
+            self.ops_queued += 1
+            self.condition.notify_all()
+
+    def _drop_covered(self, rect):
+        """Remove queued draws hidden by a draw of `rect`, newest first, up to
+        the last ordered operation"""
+        x, y, width, height = rect
+        for i in range(len(self.pending) - 1, -1, -1):
+            old_rect = self.pending[i][0]
+            if old_rect is None:
+                break
+            old_x, old_y, old_width, old_height = old_rect
+            if (x <= old_x and y <= old_y and old_x + old_width <= x + width
+                    and old_y + old_height <= y + height):
+                del self.pending[i]
+                self.draws_dropped += 1
+
+    # ========== Writer thread ==========
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                _, func, args = self.pending.popleft()
+                self.busy = True
+                self.condition.notify_all()
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"[Display] Failed to send {func.__name__}: {e}")
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def flush(self):
+        """Wait until every queued operation has been sent"""
+        with self.condition:
+            while self.pending or self.busy:
+                self.condition.wait()
+
+    def stop(self):
+        """Send what is still queued, then end the thread"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.join()
+
+    def get_stats(self):
+        return {"queued": self.ops_queued, "dropped": self.draws_dropped, "pending": len(self.pending)}
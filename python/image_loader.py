@@ -0,0 +1,135 @@
+import hashlib
+import os
+import queue
+import threading
+
+from PIL import Image
+
+from lru_cache import LRUCache
+from utils import ImageUtils
+
+
+class ImageLoader(threading.Thread):
+    """Decodes images for image mode off the render thread.
+
+    Images are center-cropped to the screen ratio, resized and converted to
+    RGB565 once. The result is kept in memory and on disk, keyed by path,
+    mtime and file size, so an unchanged image is never decoded again. The
+    disk cache keeps the most recently used DISK_CACHE_SIZE files.
+    """
+
+    MEMORY_CACHE_SIZE = 8
+    DISK_CACHE_SIZE = 32
+
+    def __init__(self, width, height, cache_dir=os.path.join(".cache", "rgb565"), on_loaded=None):
+        super().__init__(daemon=True)
+        self.width = width
+        self.height = height
+        self.cache_dir = cache_dir
+        self.on_loaded = on_loaded
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.cache = LRUCache(self.MEMORY_CACHE_SIZE)
+        self.pending = set()
+        self.failed = set()
+
+    def get(self, path):
+        """Return (key, rgb565 bytes) for `path`, or None while it is still loading"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            data = self.cache.get(key)
+            if data is not None:
+                return key, data
+            if key not in self.pending and key not in self.failed:
+                self.pending.add(key)
+                self.queue.put(key)
+        return None
+
+    def run(self):
+        while True:
+            key = self.queue.get()
+            try:
+                data = self._load(key)
+            except Exception as e:
+                print(f"[Image] Failed to load image {key[0]}: {e}")
+                with self.lock:
+                    self.pending.discard(key)
+                    self.failed.add(key)
+                continue
+            with self.lock:
+                self.pending.discard(key)
+                self.cache.put(key, data)
+            if self.on_loaded:
+                self.on_loaded()
+
+    def _cache_path(self, key):
+        digest = hashlib.sha1(repr((key, self.width, self.height)).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest + ".rgb565")
+
+    def _load(self, key):
+        cache_path = self._cache_path(key)
+        expected_size = self.width * self.height * 2
+        if os.path.exists(cache_path) and os.path.getsize(cache_path) == expected_size:
+            with open(cache_path, "rb") as f:
+                data = f.read()
+            # Mark the file as recently used so pruning keeps it
+            try:
+                os.utime(cache_path)
+            except OSError:
+                pass
+            return data
+        data = ImageUtils.image_to_rgb565(self._decode(key[0]), self.width, self.height)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+            self._prune_disk_cache()
+        except OSError as e:
+            print(f"[Image] Failed to write image cache {cache_path}: {e}")
+        return data
+
+    def _prune_disk_cache(self):
+        """Delete the least recently used cache files beyond DISK_CACHE_SIZE"""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".rgb565"):
+                try:
+                    entries.append((entry.stat().st_mtime_ns, entry.path))
+                except OSError:
+                    pass
+        if len(entries) <= self.DISK_CACHE_SIZE:
+            return
+        entries.sort(reverse=True)
+        for _, path in entries[self.DISK_CACHE_SIZE:]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _decode(self, path):
+        image = Image.open(path)
+        # Let the JPEG decoder downscale while decoding to the smallest power-of-two
+        # scale that still covers the screen (e.g. 1024x1024 -> 512x512)
+        image.draft("RGB", (self.width, self.height))
+        image = image.convert("RGB")
+        # crop center and resize to fit screen ratio
+        img_w, img_h = image.size
+        screen_ratio = self.width / self.height
+        img_ratio = img_w / img_h
+        if img_ratio > screen_ratio:
+            # crop width
+            new_w = int(img_h * screen_ratio)
+            left = (img_w - new_w) // 2
+            image = image.crop((left, 0, left + new_w, img_h))
+        else:
+            # crop height
+            new_h = int(img_w / screen_ratio)
+            top = (img_h - new_h) // 2
+            image = image.crop((0, top, img_w, top + new_h))
+        return image.resize((self.width, self.height), Image.LANCZOS)
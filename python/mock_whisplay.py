@@ -0,0 +1,116 @@
+import numpy as np
+
+import st7789
+
+
+class MockWhisplayBoard:
+    """Off-device stand-in for WhisplayBoard.
+
+    Keeps the ST7789 frame memory in a numpy array, with MCU rows mapped to
+    memory rows by MADCTL as on the panel, and emulates the vertical scroll
+    registers (which count rows in memory order), so rendering and scrolling
+    code can be run and checked without the HAT. `snapshot()` returns what
+    the panel would show and `bytes_sent` counts the pixel bytes that would
+    have gone over SPI.
+    """
+
+    LCD_WIDTH = 240
+    LCD_HEIGHT = 280
+    CornerHeight = 20
+    FRAME_MEMORY_ROWS = 320
+    ROW_OFFSET = 20
+
+    def __init__(self, madctl=0xC0):
+        self.madctl = madctl
+        self.memory = np.zeros((self.FRAME_MEMORY_ROWS, self.LCD_WIDTH), dtype=np.uint16)
+        self.scroll_area = None
+        self.scroll_start = 0
+        # VSCRDEF (top fixed, scroll height, bottom fixed) and VSCSAD
+        self.scroll_registers = None
+        self.scroll_address = None
+        self.bytes_sent = 0
+        self.draw_calls = 0
+        self.dirty_tracking = False
+        self.button_press_callback = None
+        self.button_release_callback = None
+
+    # ========== LCD Display Functions ==========
+    def set_backlight(self, brightness):
+        pass
+
+    def configure_dirty_tracking(self, enabled=True, full_refresh_ratio=None, max_rects=None):
+        self.dirty_tracking = enabled
+
+    def define_scroll_area(self, top, height):
+        self.scroll_registers = st7789.scroll_area_registers(
+            top + self.ROW_OFFSET, height, self.madctl, self.FRAME_MEMORY_ROWS)
+        self.scroll_area = (top, height)
+        self.scroll_start = -1
+        self.set_scroll_start(0)
+
+    def set_scroll_start(self, row):
+        if self.scroll_area is None:
+            return
+        top, height = self.scroll_area
+        self.scroll_address = st7789.scroll_start_address(
+            top + self.ROW_OFFSET, height, row, self.madctl, self.FRAME_MEMORY_ROWS)
+        self.scroll_start = row
+
+    def _memory_rows(self, y, height):
+        """Frame memory rows that display rows y..y+height-1 are written to"""
+        rows = np.arange(y, y + height) + self.ROW_OFFSET
+        if st7789.rows_flipped(self.madctl):
+            rows = self.FRAME_MEMORY_ROWS - 1 - rows
+        return rows
+
+    def fill_screen(self, color):
+        rows = self._memory_rows(0, self.LCD_HEIGHT)
+        self.memory[rows] = np.frombuffer(bytes([(color >> 8) & 0xFF, color & 0xFF]), dtype=np.uint16)[0]
+        self.bytes_sent += self.LCD_WIDTH * self.LCD_HEIGHT * 2
+        self.draw_calls += 1
+
+    def draw_image(self, x, y, width, height, pixel_data):
+        if (x + width > self.LCD_WIDTH) or (y + height > self.LCD_HEIGHT):
+            raise ValueError("Image size exceeds screen bounds")
+        if isinstance(pixel_data, list):
+            pixel_data = bytes(pixel_data)
+        frame = np.frombuffer(pixel_data, dtype=np.uint16).reshape(height, width)
+        self.memory[self._memory_rows(y, height), x : x + width] = frame
+        self.bytes_sent += frame.nbytes
+        self.draw_calls += 1
+
+    def snapshot(self):
+        """Return the rows currently visible on the panel, scroll applied"""
+        # The panel scans frame memory in order: display line `line` shows
+        # memory row `line` outside the scroll area and inside it the row
+        # `scroll_address` lines further on, wrapping within the area
+        lines = self._memory_rows(0, self.LCD_HEIGHT)
+        if self.scroll_registers is not None:
+            top_fixed, scroll_height, _ = self.scroll_registers
+            inside = (lines >= top_fixed) & (lines < top_fixed + scroll_height)
+            lines = np.where(
+                inside,
+                top_fixed + (lines - top_fixed + self.scroll_address - top_fixed) % scroll_height,
+                lines,
+            )
+        return self.memory[lines]
+
+    # ========== RGB and Button Functions ==========
+    def set_rgb(self, r, g, b):
+        pass
+
+    def set_rgb_fade(self, r_target, g_target, b_target, duration_ms=100):
+        pass
+
+    def button_pressed(self):
+        return False
+
+    def on_button_press(self, callback):
+        self.button_press_callback = callback
+
+    def on_button_release(self, callback):
+        self.button_release_callback = callback
+
+    # ========== Cleanup ==========
+    def cleanup(self):
+        pass
@@ -0,0 +1,59 @@
+class PendingUpdate:
+    """Display updates received since the last frame tick, merged per field.
+
+    Only the state at the next frame is ever shown, so messages are folded
+    together before they touch the display state or the hardware. Scalar
+    fields keep the last value written. A text replacement (`text_replace` or
+    plain `text`) drops any pending text, and `text_append` messages with
+    consecutive sequence numbers are concatenated onto the pending text.
+    """
+
+    def __init__(self):
+        self.fields = {}
+        # Pending text: a replacement (is_append False) or an append, as parts
+        # to join, with the sequence numbers of its first and last message
+        self.text_parts = None
+        self.is_append = False
+        self.text_seq = None
+        self.text_seq_end = None
+        # Clients whose appends are merged in, told to resync if they are dropped
+        self.text_clients = set()
+        # Messages per client still waiting for a batched acknowledgement
+        self.acks = {}
+
+    def set(self, **fields):
+        for name, value in fields.items():
+            if value is not None:
+                self.fields[name] = value
+
+    def replace_text(self, text, seq):
+        self.text_parts = [text]
+        self.is_append = False
+        self.text_seq = self.text_seq_end = seq
+        self.text_clients.clear()
+
+    def append_text(self, text, seq, client):
+        """Merge an append; returns False when it does not directly follow the
+        pending text, in which case the pending update has to be applied first"""
+        if self.text_parts is None:
+            self.text_parts = [text]
+            self.is_append = True
+            self.text_seq = self.text_seq_end = seq
+        elif seq is not None and self.text_seq_end is not None and seq == self.text_seq_end + 1:
+            self.text_parts.append(text)
+            self.text_seq_end = seq
+        else:
+            return False
+        self.text_clients.add(client)
+        return True
+
+    def add_ack(self, client):
+        self.acks[client] = self.acks.get(client, 0) + 1
+
+    @property
+    def text(self):
+        if self.text_parts is None:
+            return None
+        if len(self.text_parts) > 1:
+            self.text_parts = ["".join(self.text_parts)]
+        return self.text_parts[0]
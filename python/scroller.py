@@ -0,0 +1,93 @@
+import numpy as np
+
+
+class TextScroller:
+    """Pushes the visible rows of the text area to the panel.
+
+    The scroller remembers what it last wrote to the text area and only sends
+    rows that differ. With `hardware_scroll` the text area is defined as the
+    ST7789 vertical scroll region and used as a ring buffer: a scroll step
+    moves the hardware scroll pointer, after which only the newly exposed
+    rows need to be sent. Without it (software fallback) the whole area keeps
+    a fixed layout and shifted rows are resent.
+    """
+
+    def __init__(self, whisplay, top, height, hardware_scroll=False):
+        self.whisplay = whisplay
+        self.top = top
+        self.height = height
+        self.width = whisplay.LCD_WIDTH
+        self.hardware_scroll = hardware_scroll
+        # Last pixels written to each row of the area, in panel memory order
+        self.area = np.zeros((height, self.width), dtype=np.uint16)
+        self.scroll_top = None
+        if hardware_scroll:
+            whisplay.define_scroll_area(top, height)
+
+    def invalidate(self):
+        """Forget the area contents, e.g. after something else drew over it"""
+        self.scroll_top = None
+
+    def present(self, scroll_top, pixels):
+        """Show `pixels` (height x width RGB565 rows) for the given scroll offset"""
+        force = self.scroll_top is None
+        offset = 0
+        if self.hardware_scroll:
+            offset = self.whisplay.scroll_start
+            if not force:
+                step = scroll_top - self.scroll_top
+                if step != 0 and abs(step) < self.height:
+                    offset = (offset + step) % self.height
+                    self.whisplay.set_scroll_start(offset)
+        # Row k of the viewport lives in memory row (offset + k) % height
+        split = self.height - offset
+        self._write(offset, pixels[:split], force)
+        self._write(0, pixels[split:], force)
+        self.scroll_top = scroll_top
+
+    def _write(self, row, pixels, force):
+        if len(pixels) == 0:
+            return
+        current = self.area[row : row + len(pixels)]
+        if force:
+            starts, ends = [0], [len(pixels)]
+        else:
+            changed = np.flatnonzero((current != pixels).any(axis=1))
+            if changed.size == 0:
+                return
+            breaks = np.flatnonzero(np.diff(changed) > 1)
+            starts = np.concatenate(([changed[0]], changed[breaks + 1]))
+            ends = np.concatenate((changed[breaks], [changed[-1]])) + 1
+        for start, end in zip(starts, ends):
+            self.whisplay.draw_image(
+                0, self.top + row + start, self.width, end - start,
+                np.ascontiguousarray(pixels[start:end]),
+            )
+        current[:, :] = pixels
+
+
+if __name__ == "__main__":
+    # Scroll a random strip on the mock board and compare both modes, with
+    # the panel's row order (MADCTL 0xC0) and with MY cleared
+    from mock_whisplay import MockWhisplayBoard
+
+    top, height = 98, 182
+    rng = np.random.default_rng(0)
+    strip = rng.integers(0, 0xFFFF, size=(2000, 240), dtype=np.uint16)
+    header = rng.integers(0, 0xFFFF, size=(top, 240), dtype=np.uint16)
+    for madctl in (0xC0, 0x00):
+        for hardware_scroll in (False, True):
+            board = MockWhisplayBoard(madctl=madctl)
+            board.draw_image(0, 0, 240, top, header.tobytes())
+            scroller = TextScroller(board, top, height, hardware_scroll=hardware_scroll)
+            scroller.present(0, strip[:height])
+            board.bytes_sent = 0
+            frames = 0
+            for scroll_top in range(2, 1500, 2):
+                scroller.present(scroll_top, strip[scroll_top : scroll_top + height])
+                shown = board.snapshot()
+                assert (shown[top : top + height] == strip[scroll_top : scroll_top + height]).all()
+                assert (shown[:top] == header).all()
+                frames += 1
+            mode = "hardware" if hardware_scroll else "software"
+            print(f"[Scroller] MADCTL 0x{madctl:02X} {mode}: {board.bytes_sent / frames / 1024:.1f} KB/frame")
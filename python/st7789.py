@@ -0,0 +1,36 @@
+"""ST7789 register values that depend on the memory access order (MADCTL).
+
+Kept free of hardware imports so MockWhisplayBoard programs its emulated
+panel with the same values WhisplayBoard sends to the real one.
+"""
+
+# MADCTL bit 7: MCU row r is written to frame memory row FRAME_MEMORY_ROWS - 1 - r
+MADCTL_MY = 0x80
+
+
+def rows_flipped(madctl):
+    return bool(madctl & MADCTL_MY)
+
+
+def scroll_area_registers(first_row, height, madctl, frame_memory_rows):
+    """VSCRDEF (0x33) parameters (top fixed, scroll height, bottom fixed) for
+    the scroll region starting at MCU row `first_row`.
+
+    The scroll registers count rows in frame memory order, so with MY set the
+    region is mirrored and the fixed areas swap places.
+    """
+    if rows_flipped(madctl):
+        top_fixed = frame_memory_rows - (first_row + height)
+    else:
+        top_fixed = first_row
+    return top_fixed, height, frame_memory_rows - top_fixed - height
+
+
+def scroll_start_address(first_row, height, row, madctl, frame_memory_rows):
+    """VSCSAD (0x37) address that shows region row `row` (in MCU order) at the
+    top of the region"""
+    top_fixed = scroll_area_registers(first_row, height, madctl, frame_memory_rows)[0]
+    if rows_flipped(madctl):
+        # Scrolling forward in MCU rows moves backwards through frame memory
+        row = -row % height
+    return top_fixed + row
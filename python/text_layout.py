@@ -0,0 +1,146 @@
+from bisect import bisect_left, bisect_right
+
+import numpy as np
+from PIL import Image
+
+from utils import ImageUtils, TextUtils
+
+
+class TextLayout:
+    """Wrapped lines of the main text area.
+
+    Streamed replies only ever grow, so when new text is a continuation of the
+    current one only the last (possibly partial) line is wrapped again and
+    every finished line is kept.
+
+    Lines are rasterized once, on first display, into a tall RGB565 strip
+    that grows with the text. A frame is then just a slice of the strip at the
+    current scroll offset. The strip holds at most MAX_STRIP_ROWS rows: for
+    longer text it is a window starting at `strip_top` that moves with the
+    viewport, and lines that leave it are rasterized again when shown.
+    """
+
+    MAX_STRIP_ROWS = 1024
+
+    def __init__(self, font, width, max_width, line_height, margin_left=10):
+        self.font = font
+        self.width = width
+        self.max_width = max_width
+        self.line_height = line_height
+        self.margin_left = margin_left
+        self.text = ""
+        self.lines = []
+        self.line_starts = []
+        self.line_rasterized = []
+        # y offset of the top of every line, plus one entry for the bottom of
+        # the last line, so visible lines can be found by binary search
+        self.line_tops = [0]
+        self.strip = np.zeros((0, width), dtype=np.uint16)
+        self.strip_top = 0
+
+    def set_text(self, text):
+        if text is self.text or text == self.text:
+            return
+        if text.startswith(self.text):
+            self.append(text[len(self.text):], text)
+        else:
+            self.reset(text)
+
+    def reset(self, text=""):
+        self.text = ""
+        self.lines = []
+        self.line_starts = []
+        self.line_rasterized = []
+        self.line_tops = [0]
+        # Drop the strip of the previous text instead of clearing it, so one
+        # long reply does not keep its memory for the following ones
+        self.strip = np.zeros((0, self.width), dtype=np.uint16)
+        self.strip_top = 0
+        self.append(text)
+
+    def append(self, new_text, full_text=None):
+        if not new_text:
+            return
+        self.text = full_text if full_text is not None else self.text + new_text
+        # Wrap again from the start of the last line, earlier lines can't change
+        first = max(len(self.lines) - 1, 0)
+        start = self.line_starts[first] if self.lines else 0
+        clear_start = max(self.line_tops[first] - self.strip_top, 0)
+        clear_end = self.line_tops[-1] - self.strip_top
+        if clear_end > clear_start:
+            self.strip[clear_start:clear_end, :] = 0
+        del self.lines[first:]
+        del self.line_starts[first:]
+        del self.line_rasterized[first:]
+        del self.line_tops[first + 1:]
+        text = self.text[start:]
+        for line_start, line_end in TextUtils.layout_text(text, self.font, self.max_width):
+            self.lines.append(text[line_start:line_end])
+            self.line_starts.append(start + line_start)
+            self.line_rasterized.append(False)
+            self.line_tops.append(self.line_tops[-1] + self.line_height)
+
+    @property
+    def height(self):
+        return self.line_tops[-1]
+
+    def visible_range(self, scroll_top, area_height):
+        """Return (first, end) indexes of the lines overlapping the viewport"""
+        first = max(bisect_right(self.line_tops, scroll_top) - 1, 0)
+        end = bisect_left(self.line_tops, scroll_top + area_height)
+        return first, min(max(end, first), len(self.lines))
+
+    def viewport(self, scroll_top, area_height):
+        """Return the RGB565 rows visible at `scroll_top` as a view into the strip"""
+        first, end = self.visible_range(scroll_top, area_height)
+        # Cover the visible lines entirely, a line is never drawn in part
+        self._reserve(
+            min(scroll_top, self.line_tops[first]),
+            max(scroll_top + area_height, self.line_tops[end]),
+        )
+        for i in range(first, end):
+            if not self.line_rasterized[i]:
+                self._rasterize_line(i)
+        start = scroll_top - self.strip_top
+        return self.strip[start:start + area_height]
+
+    def _reserve(self, top, bottom):
+        """Make sure the strip covers text rows top..bottom-1"""
+        rows = self.strip.shape[0]
+        if self.strip_top <= top and bottom <= self.strip_top + rows:
+            return
+        capacity = max(self.MAX_STRIP_ROWS, bottom - top)
+        if self.strip_top == 0 and bottom <= capacity:
+            # Still fits from the top of the text, grow the strip
+            strip = np.zeros((min(max(bottom, rows * 2), capacity), self.width), dtype=np.uint16)
+            strip[:rows] = self.strip
+            self.strip = strip
+            return
+        # Move the window to start at the viewport, keeping the rows both
+        # windows share; lines not entirely within them are drawn again
+        new_top = top
+        keep_start = max(self.strip_top, new_top)
+        keep_end = min(self.strip_top + rows, new_top + capacity)
+        strip = np.zeros((capacity, self.width), dtype=np.uint16)
+        if keep_end > keep_start:
+            strip[keep_start - new_top:keep_end - new_top] = self.strip[keep_start - self.strip_top:keep_end - self.strip_top]
+        for i, rasterized in enumerate(self.line_rasterized):
+            if rasterized and not (keep_start <= self.line_tops[i] and self.line_tops[i + 1] <= keep_end):
+                self.line_rasterized[i] = False
+        self.strip = strip
+        self.strip_top = new_top
+
+    def _rasterize_line(self, index):
+        self.line_rasterized[index] = True
+        line_image = TextUtils.get_line_img(self.lines[index], self.font)
+        if line_image.width == 0:
+            return
+        # Composite the same way the line used to reach the screen: onto an
+        # opaque text surface first, then onto the black background
+        surface = Image.new("RGBA", line_image.size, (0, 0, 0, 255))
+        surface.paste(line_image, (0, 0), line_image)
+        pixels = ImageUtils.rgba_to_rgb565_array(surface)
+        top = self.line_tops[index] - self.strip_top
+        height = min(pixels.shape[0], self.line_height)
+        width = min(pixels.shape[1], self.width - self.margin_left)
+        self.strip[top:top + height, self.margin_left:self.margin_left + width] = pixels[:height, :width]
@@ -1,10 +1,16 @@
+import json
+import mmap
 import os
+import threading
 import unicodedata
 from io import BytesIO
 import numpy as np
 from PIL import Image, ImageDraw, ImageFont
-import cairosvg
-import cv2
+from lru_cache import LRUCache, image_nbytes
+try:
+  import cv2
+except ImportError:
+  cv2 = None
 
 class ColorUtils:
   @staticmethod
@@ -63,31 +69,130 @@ class ColorUtils:
     return 0.299 * r + 0.587 * g + 0.114 * b
 
 
+class Rgb565Converter:
+  """RGB888 到屏幕字节序 (大端) RGB565 的转换器。
+
+  每个线程按 (宽, 高) 复用输出和临时缓冲区，打包和字节交换一次完成。
+  首次使用时用一帧随机图像测速，在 numpy / 查找表 / cv2 后端中选出结果
+  正确且最快的一个。
+  """
+
+  def __init__(self):
+    self.local = threading.local()
+    self.backend = None
+    self.backends = {
+      "numpy": self._convert_numpy,
+      "lut": self._convert_lut,
+    }
+    if cv2 is not None:
+      self.backends["cv2"] = self._convert_cv2
+    index = np.arange(256, dtype=np.uint8)
+    self.lut_r_hi = index & 0xF8
+    self.lut_g_hi = index >> 5
+    self.lut_g_lo = (index << 3) & 0xE0
+    self.lut_b_lo = index >> 3
+
+  def _buffers(self, width, height):
+    buffers = getattr(self.local, "buffers", None)
+    if buffers is None:
+      buffers = self.local.buffers = {}
+    entry = buffers.get((width, height))
+    if entry is None:
+      entry = (np.empty((height, width, 2), dtype=np.uint8), np.empty((height, width), dtype=np.uint8))
+      buffers[(width, height)] = entry
+    return entry
+
+  def _convert_numpy(self, rgb, out, tmp):
+    hi = out[:, :, 0]
+    lo = out[:, :, 1]
+    np.bitwise_and(rgb[:, :, 0], 0xF8, out=hi)
+    np.right_shift(rgb[:, :, 1], 5, out=tmp)
+    np.bitwise_or(hi, tmp, out=hi)
+    np.left_shift(rgb[:, :, 1], 3, out=lo)
+    np.bitwise_and(lo, 0xE0, out=lo)
+    np.right_shift(rgb[:, :, 2], 3, out=tmp)
+    np.bitwise_or(lo, tmp, out=lo)
+
+  def _convert_lut(self, rgb, out, tmp):
+    hi = out[:, :, 0]
+    lo = out[:, :, 1]
+    np.take(self.lut_r_hi, rgb[:, :, 0], out=hi)
+    np.take(self.lut_g_hi, rgb[:, :, 1], out=tmp)
+    np.bitwise_or(hi, tmp, out=hi)
+    np.take(self.lut_g_lo, rgb[:, :, 1], out=lo)
+    np.take(self.lut_b_lo, rgb[:, :, 2], out=tmp)
+    np.bitwise_or(lo, tmp, out=lo)
+
+  def _convert_cv2(self, rgb, out, tmp):
+    code = cv2.COLOR_RGB2BGR565 if rgb.shape[2] == 3 else cv2.COLOR_RGBA2BGR565
+    cv2.cvtColor(rgb, code, dst=out)
+    out.view(np.uint16).byteswap(inplace=True)
+
+  def select_backend(self, width=240, height=280, rounds=5):
+    """测速并选择最快且结果与 numpy 实现一致的后端。"""
+    import time
+    rgb = np.random.default_rng(0).integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    reference = None
+    timings = {}
+    for name, convert in self.backends.items():
+      out = np.empty((height, width, 2), dtype=np.uint8)
+      tmp = np.empty((height, width), dtype=np.uint8)
+      try:
+        convert(rgb, out, tmp)
+        if reference is None:
+          reference = out.copy()
+        elif not np.array_equal(out, reference):
+          continue
+        start = time.perf_counter()
+        for _ in range(rounds):
+          convert(rgb, out, tmp)
+        timings[name] = (time.perf_counter() - start) / rounds
+      except Exception as e:
+        print(f"[RGB565] Backend {name} unavailable: {e}")
+    self.backend = min(timings, key=timings.get)
+    print(f"[RGB565] Using {self.backend} backend ({timings[self.backend] * 1000:.2f} ms/frame)")
+    return self.backend
+
+  def convert(self, rgb: np.ndarray, copy=True):
+    """转换 (高, 宽, 3 或 4) 的 uint8 数组。copy=False 时返回复用缓冲区的视图，
+    在本线程下一次转换同尺寸图像前有效。"""
+    if self.backend is None:
+      self.select_backend()
+    height, width = rgb.shape[:2]
+    out, tmp = self._buffers(width, height)
+    convert = self.backends[self.backend]
+    if convert is self._convert_cv2 and not rgb.flags.c_contiguous:
+      convert = self._convert_numpy
+    convert(rgb, out, tmp)
+    return out.tobytes() if copy else out
+
+
 class ImageUtils:
+  rgb565_converter = Rgb565Converter()
+
   @staticmethod
-  def image_to_rgb565(image: Image.Image, width: int, height: int) -> list:
-    image = image.convert("RGB")
-    image.thumbnail((width, height), Image.LANCZOS)
-    bg = Image.new("RGB", (width, height), (0, 0, 0))
-    x = (width - image.width) // 2
-    y = (height - image.height) // 2
-    bg.paste(image, (x, y))
-    np_img = np.array(bg)
-    r = (np_img[:, :, 0] >> 3).astype(np.uint16)
-    g = (np_img[:, :, 1] >> 2).astype(np.uint16)
-    b = (np_img[:, :, 2] >> 3).astype(np.uint16)
-    rgb565 = (r << 11) | (g << 5) | b
-    return rgb565.byteswap().tobytes()
+  def image_to_rgb565(image: Image.Image, width: int, height: int, copy=True):
+    if image.mode != "RGB":
+      image = image.convert("RGB")
+    elif image.size != (width, height):
+      image = image.copy()
+    if image.size != (width, height):
+      image.thumbnail((width, height), Image.LANCZOS)
+      bg = Image.new("RGB", (width, height), (0, 0, 0))
+      x = (width - image.width) // 2
+      y = (height - image.height) // 2
+      bg.paste(image, (x, y))
+      image = bg
+    return ImageUtils.rgb565_converter.convert(np.asarray(image), copy=copy)
   
   @staticmethod
-  def convertCameraFrameToRGB565(frame: np.ndarray, width: int, height: int):
+  def convertCameraFrameToRGB565(frame: np.ndarray, width: int, height: int, copy=True):
     # Resize frame to fit the display
-    frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_NEAREST)
-    r = (frame[:, :, 0] >> 3).astype(np.uint16)  # 5 bit
-    g = (frame[:, :, 1] >> 2).astype(np.uint16)  # 6 bit
-    b = (frame[:, :, 2] >> 3).astype(np.uint16)  # 5 bit
-    rgb565_data = (r << 11) | (g << 5) | b
-    return rgb565_data.byteswap().tobytes()
+    if frame.shape[1] != width or frame.shape[0] != height:
+      if cv2 is None:
+        return ImageUtils.image_to_rgb565(Image.fromarray(frame[:, :, :3]).resize((width, height), Image.NEAREST), width, height, copy=copy)
+      frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_NEAREST)
+    return ImageUtils.rgb565_converter.convert(frame, copy=copy)
   
   @staticmethod
   def crop_center(image: Image.Image, target_width: int, target_height: int) -> Image.Image:
@@ -98,66 +203,453 @@ class ImageUtils:
     bottom = (height + target_height) // 2
     return image.crop((left, top, right, bottom)).resize((target_width, target_height), Image.LANCZOS)
 
+  @staticmethod
+  def rgba_to_rgb565_array(image: Image.Image) -> np.ndarray:
+    """将 RGBA 图像叠加到黑色背景上，返回按屏幕字节序排列的 RGB565 数组。"""
+    bg = Image.new("RGB", image.size, (0, 0, 0))
+    bg.paste(image, (0, 0), image)
+    pixels = ImageUtils.rgb565_converter.convert(np.asarray(bg), copy=False)
+    return pixels.view(np.uint16).reshape(image.height, image.width).copy()
+
+
+class FontPack:
+  """build_font_pack.py 生成的预渲染字体包，通过 mmap 只读映射。
+
+  文件结构: 头部 (魔数、版本、字号数量、源字体文件名)，每个字号一条
+  SIZE_DTYPE 记录，每个字号一张按码点排序的 INDEX_DTYPE 索引表，以及所有
+  字形的 8 位 alpha 遮罩。字形数据直接引用映射内存，不复制。
+  """
+
+  MAGIC = b"WFPK"
+  VERSION = 1
+  HEADER_DTYPE = np.dtype([("magic", "S4"), ("version", "<u2"), ("size_count", "<u2"), ("name_length", "<u2"), ("reserved", "<u2")])
+  SIZE_DTYPE = np.dtype([("size", "<u2"), ("ascent", "<i2"), ("descent", "<i2"), ("reserved", "<u2"), ("glyph_count", "<u4"), ("index_offset", "<u4")])
+  INDEX_DTYPE = np.dtype([("codepoint", "<u4"), ("advance", "<i2"), ("height", "<i2"), ("left", "<i2"), ("top", "<i2"), ("width", "<u2"), ("rows", "<u2"), ("offset", "<u4")])
+
+  def __init__(self, path):
+    with open(path, "rb") as f:
+      self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    header = np.frombuffer(self.data, dtype=FontPack.HEADER_DTYPE, count=1)[0]
+    if header["magic"] != FontPack.MAGIC or header["version"] != FontPack.VERSION:
+      raise ValueError(f"{path} is not a version {FontPack.VERSION} font pack")
+    offset = FontPack.HEADER_DTYPE.itemsize
+    self.source = bytes(self.data[offset:offset + header["name_length"]]).decode("utf-8")
+    offset += (header["name_length"] + 3) // 4 * 4
+    self.sizes = {}
+    for entry in np.frombuffer(self.data, dtype=FontPack.SIZE_DTYPE, count=header["size_count"], offset=offset):
+      index = np.frombuffer(self.data, dtype=FontPack.INDEX_DTYPE, count=entry["glyph_count"], offset=entry["index_offset"])
+      self.sizes[int(entry["size"])] = (int(entry["ascent"]), int(entry["descent"]), index)
+
+  def covers(self, path, size):
+    return os.path.basename(path) == self.source and size in self.sizes
+
+  def get_glyph(self, size, char):
+    """返回 (遮罩, left, top, 步进, 高度)，字体包中没有该字符时返回 None。"""
+    index = self.sizes[size][2]
+    codepoint = ord(char)
+    i = np.searchsorted(index["codepoint"], codepoint)
+    if i >= len(index) or index["codepoint"][i] != codepoint:
+      return None
+    entry = index[i]
+    rows, width = int(entry["rows"]), int(entry["width"])
+    mask = np.frombuffer(self.data, dtype=np.uint8, count=rows * width, offset=int(entry["offset"])).reshape(rows, width)
+    return mask, int(entry["left"]), int(entry["top"]), int(entry["advance"]), int(entry["height"])
+
+
+class PackedFont(ImageFont.FreeTypeFont):
+  """字体包中某一字号的字体，可直接传给 Pillow 使用。
+  FreeType 字体只在用到字体包中没有的字形或其他方法时才加载。"""
+
+  def __init__(self, pack, path, size, index=0):
+    self.pack = pack
+    self.path = path
+    self.size = size
+    self.index = index
+    self.ascent, self.descent = pack.sizes[size][:2]
+    self.freetype_loaded = False
+
+  def getmetrics(self):
+    return self.ascent, self.descent
+
+  def get_packed_glyph(self, char):
+    return self.pack.get_glyph(self.size, char)
+
+  def __getattr__(self, name):
+    # 首次访问 FreeType 的属性 (self.font 等) 时加载字体
+    if name.startswith("__") or self.__dict__.get("freetype_loaded", True):
+      raise AttributeError(name)
+    self.freetype_loaded = True
+    freetype = ImageFont.truetype(self.path, self.size, index=self.index)
+    for key, value in freetype.__dict__.items():
+      self.__dict__.setdefault(key, value)
+    return getattr(self, name)
+
+
+font_cache = {}
+font_cache_keys = {}
+font_cache_stats = {"hits": 0, "misses": 0}
+font_cache_lock = threading.Lock()
+font_pack = None
+
+class FontUtils:
+  @staticmethod
+  def get_font(path, size, index=0):
+    """获取字体对象，同一 (路径, 字号, 索引) 在进程内只加载一次。"""
+    cache_key = (path, size, index)
+    font = font_cache.get(cache_key)
+    if font is not None:
+      font_cache_stats["hits"] += 1
+      return font
+    with font_cache_lock:
+      font = font_cache.get(cache_key)
+      if font is None:
+        font_cache_stats["misses"] += 1
+        if font_pack is not None and index == 0 and font_pack.covers(path, size):
+          font = PackedFont(font_pack, path, size, index)
+        else:
+          font = ImageFont.truetype(path, size, index=index)
+        font_cache[cache_key] = font
+        font_cache_keys[id(font)] = cache_key
+      else:
+        font_cache_stats["hits"] += 1
+      return font
+
+  @staticmethod
+  def load_font_pack(path="font_pack.bin"):
+    """映射预渲染字体包，之后 get_font 对包内的字号返回 PackedFont。"""
+    global font_pack
+    try:
+      font_pack = FontPack(path)
+    except (OSError, ValueError) as e:
+      print(f"[Font] Font pack not loaded: {e}")
+      font_pack = None
+      return None
+    return font_pack
+
+  @staticmethod
+  def font_key(font):
+    """返回字体的缓存键，已注册的字体无需再调用 getname()。"""
+    cache_key = font_cache_keys.get(id(font))
+    if cache_key is not None:
+      return cache_key
+    return (font.getname(), font.size)
+
+  @staticmethod
+  def get_cache_stats():
+    """返回字体缓存的命中/未命中次数和已加载的字体数量。"""
+    return dict(font_cache_stats, fonts=len(font_cache))
+
+
+emoji_svg_dir = "emoji_svg"
+emoji_svg_index = None
+emoji_svg_prefixes = None
+emoji_missing = set()
+# Pre-rendered sprites from build_emoji_atlas.py: code point sequence -> {size: (offset, w, h)}
+emoji_atlas_path = "emoji_atlas"
+emoji_atlas = None
+emoji_atlas_index = {}
+emoji_atlas_sprites = {}
 
 class EmojiUtils:
   @staticmethod
   def emoji_to_filename(char):
     return '-'.join(f"{ord(c):x}" for c in char) + ".svg"
 
+  @staticmethod
+  def load_emoji_index(directory=None):
+    """扫描一次 emoji_svg 目录，建立 码点序列 -> 文件名 的索引 (含多码点序列)。"""
+    global emoji_svg_index, emoji_svg_prefixes
+    directory = directory or emoji_svg_dir
+    index = {}
+    prefixes = set()
+    try:
+      filenames = os.listdir(directory)
+    except OSError:
+      filenames = []
+    for filename in filenames:
+      if not filename.endswith(".svg"):
+        continue
+      try:
+        sequence = tuple(int(part, 16) for part in filename[:-4].split("-"))
+      except ValueError:
+        continue
+      index[sequence] = filename
+      for i in range(1, len(sequence)):
+        prefixes.add(sequence[:i])
+    for sequence in emoji_atlas_index:
+      index.setdefault(sequence, EmojiUtils.emoji_to_filename("".join(chr(c) for c in sequence)))
+      for i in range(1, len(sequence)):
+        prefixes.add(sequence[:i])
+    emoji_svg_prefixes = prefixes
+    emoji_svg_index = index
+    emoji_missing.clear()
+    return len(index)
+
+  @staticmethod
+  def load_emoji_atlas(path=None):
+    """内存映射预渲染的 Emoji 图集 (<path>.bin + <path>.json)，返回精灵数量。"""
+    global emoji_atlas, emoji_atlas_index, emoji_svg_index
+    path = path or emoji_atlas_path
+    try:
+      with open(path + ".json", "r", encoding="utf-8") as f:
+        meta = json.load(f)
+      with open(path + ".bin", "rb") as f:
+        atlas = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      return 0
+    index = {}
+    for stem, sprites in meta["sprites"].items():
+      sequence = tuple(int(part, 16) for part in stem.split("-"))
+      index[sequence] = {int(size): tuple(entry) for size, entry in sprites.items()}
+    emoji_atlas = atlas
+    emoji_atlas_index = index
+    emoji_atlas_sprites.clear()
+    # Rebuild the lookup index so it covers the atlas as well
+    emoji_svg_index = None
+    return sum(len(sprites) for sprites in index.values())
+
+  @staticmethod
+  def get_atlas_sprite(char, size):
+    """从图集中取出 Emoji 精灵，图像直接引用映射内存，不复制像素。"""
+    cache_key = (char, size)
+    sprite = emoji_atlas_sprites.get(cache_key)
+    if sprite is not None:
+      return sprite
+    entry = emoji_atlas_index.get(tuple(ord(c) for c in char), {}).get(size)
+    if entry is None:
+      return None
+    offset, width, height = entry
+    pixels = memoryview(emoji_atlas)[offset:offset + width * height * 4]
+    sprite = Image.frombuffer("RGBA", (width, height), pixels, "raw", "RGBA", 0, 1)
+    emoji_atlas_sprites[cache_key] = sprite
+    return sprite
+
+  @staticmethod
+  def render_emoji_svg(path, size):
+    """用 cairosvg 渲染 SVG (仅在图集中没有该尺寸时使用)。"""
+    import cairosvg
+    png_bytes = cairosvg.svg2png(url=path, output_width=size, output_height=size)
+    return Image.open(BytesIO(png_bytes)).convert("RGBA")
+
+  @staticmethod
+  def find_emoji_svg(char):
+    """返回 Emoji 对应的 SVG 文件名，没有则返回 None (不访问文件系统)。"""
+    if emoji_svg_index is None:
+      EmojiUtils.load_emoji_index()
+    return emoji_svg_index.get(tuple(ord(c) for c in char))
+
+  @staticmethod
+  def match_emoji_sequence(text, start=0):
+    """返回从 start 开始、有对应 SVG 的最长 Emoji 序列的长度，没有则返回 0。"""
+    if emoji_svg_index is None:
+      EmojiUtils.load_emoji_index()
+    matched = 0
+    sequence = ()
+    for i in range(start, len(text)):
+      sequence += (ord(text[i]),)
+      if sequence in emoji_svg_index:
+        matched = len(sequence)
+      if sequence not in emoji_svg_prefixes:
+        break
+    return matched
+
+  @staticmethod
+  def split_emoji_sequences(text):
+    """把文本拆成绘制单元: 有对应 SVG 的多码点 Emoji 序列 (如 ZWJ 组合、肤色)
+    作为一个单元，其余每个字符一个单元。"""
+    if emoji_svg_index is None:
+      EmojiUtils.load_emoji_index()
+    if not any((ord(char),) in emoji_svg_prefixes for char in set(text)):
+      return list(text)
+    units = []
+    i = 0
+    while i < len(text):
+      length = 1
+      if (ord(text[i]),) in emoji_svg_prefixes:
+        length = max(EmojiUtils.match_emoji_sequence(text, i), 1)
+      units.append(text[i:i + length])
+      i += length
+    return units
+
   @staticmethod
   def get_local_emoji_svg_image(char, size):
-    global emoji_image_cache
-    if (char, size) in emoji_image_cache:
-      return emoji_image_cache[(char, size)]
-
-    filename = EmojiUtils.emoji_to_filename(char)
-    path = os.path.join("emoji_svg", filename)
-    if not os.path.exists(path):
-      # print(f"[警告] 找不到 SVG 图标: {path}")
+    if emoji_atlas is not None:
+      img = EmojiUtils.get_atlas_sprite(char, size)
+      if img is not None:
+        return img
+    img = emoji_image_cache.get((char, size))
+    if img is not None:
+      return img
+    if (char, size) in emoji_missing:
       return None
+
+    filename = EmojiUtils.find_emoji_svg(char)
+    if filename is None:
+      # print(f"[警告] 找不到 SVG 图标: {char}")
+      emoji_missing.add((char, size))
+      return None
+    path = os.path.join(emoji_svg_dir, filename)
     try:
-      png_bytes = cairosvg.svg2png(url=path, output_width=size, output_height=size)
-      img = Image.open(BytesIO(png_bytes)).convert("RGBA")
-      emoji_image_cache[(char, size)] = img
-      return img
+      img = EmojiUtils.render_emoji_svg(path, size)
+      return emoji_image_cache.put((char, size), img)
     except Exception as e:
       print(f"[错误] 渲染 SVG 出错: {e}")
+      emoji_missing.add((char, size))
       return None
 
   @staticmethod
   def clean_emoji_image_cache():
     """清除 Emoji 图像缓存。"""
-    global emoji_image_cache
-    emoji_image_cache = {}
+    emoji_image_cache.clear()
 
   @staticmethod
   def is_emoji(char):
+    if len(char) > 1:
+      return True
     return unicodedata.category(char) in ('So', 'Sk') or ord(char) > 0x1F000
 
 
-emoji_image_cache = {}
-char_size_cache = {}
-line_image_cache = {}
+# Bounded so long-running devices keep a stable memory footprint
+emoji_image_cache = LRUCache(256, max_bytes=4 * 1024 * 1024, sizeof=image_nbytes)
+char_size_cache = LRUCache(8192)
+line_image_cache = LRUCache(512, max_bytes=8 * 1024 * 1024, sizeof=image_nbytes)
+
+glyph_atlases = {}
+
+# 换行分类: 空格后可换行；宽字符 (中日韩、Emoji) 前后可换行，
+# 但不能在行首放闭合标点，也不能在行尾放开括号
+BREAK_SPACE = 1
+BREAK_WIDE = 2
+BREAK_NO_START = 4
+BREAK_NO_END = 8
+no_line_start_chars = set("，。、；：？！）》」』】〕〉’”…·,.;:?!)]}%")
+no_line_end_chars = set("（《「『【〔〈‘“([{")
+char_break_classes = {}
+
+class GlyphAtlas:
+  """单个字体 (字体, 字号) 的字形图集。
+
+  每个字符首次出现时保存其 8 位 alpha 遮罩、偏移和步进宽度，之后行图像由
+  numpy 切片合成，不再逐字调用 draw.text。合成方式与 draw.text / paste 相同
+  (alpha 叠加的取整方式一致)，可用 compare_with_reference 检查差异。
+  """
+
+  def __init__(self, font):
+    self.font = font
+    self.ascent, self.descent = font.getmetrics()
+    self.line_height = self.ascent + self.descent
+    self.glyphs = {}
+
+  @staticmethod
+  def for_font(font):
+    cache_key = FontUtils.font_key(font)
+    atlas = glyph_atlases.get(cache_key)
+    if atlas is None:
+      atlas = glyph_atlases[cache_key] = GlyphAtlas(font)
+    return atlas
+
+  def get_glyph(self, char):
+    """返回 (类型, 像素, x 偏移, y 偏移, 步进)，类型为 "mask" / "emoji" / None。"""
+    glyph = self.glyphs.get(char)
+    if glyph is not None:
+      return glyph
+    advance = TextUtils.get_char_size(self.font, char)[0]
+    if EmojiUtils.is_emoji(char):
+      emoji_img = EmojiUtils.get_local_emoji_svg_image(char, size=self.font.size)
+      if emoji_img:
+        glyph = ("emoji", np.asarray(emoji_img.convert("RGBA")), 0, self.ascent - emoji_img.height, emoji_img.width)
+      else:
+        glyph = (None, None, 0, 0, 0)
+    else:
+      packed = self.font.get_packed_glyph(char) if isinstance(self.font, PackedFont) else None
+      if packed is not None:
+        mask, left, top = packed[:3]
+        glyph = ("mask", mask, left, top, advance) if mask.size else (None, None, 0, 0, advance)
+      else:
+        left, top, right, bottom = self.font.getbbox(char)
+        if right > left and bottom > top:
+          mask_img = Image.new("L", (right - left, bottom - top), 0)
+          ImageDraw.Draw(mask_img).text((-left, -top), char, font=self.font, fill=255)
+          glyph = ("mask", np.asarray(mask_img), left, top, advance)
+        else:
+          glyph = (None, None, 0, 0, advance)
+    self.glyphs[char] = glyph
+    return glyph
+
+  def render_line(self, text):
+    """合成一行文字，返回白色文字、透明背景的 RGBA 图像。"""
+    glyphs = [self.get_glyph(unit) for unit in EmojiUtils.split_emoji_sequences(text)]
+    width = sum(glyph[4] for glyph in glyphs)
+    height = self.line_height
+    canvas = np.zeros((height, width, 4), dtype=np.uint8)
+    x = 0
+    for kind, pixels, off_x, off_y, advance in glyphs:
+      if kind is not None:
+        x0, y0 = x + off_x, off_y
+        x1, y1 = x0 + pixels.shape[1], y0 + pixels.shape[0]
+        cx0, cy0, cx1, cy1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+        if cx0 < cx1 and cy0 < cy1:
+          src = pixels[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+          dst = canvas[cy0:cy1, cx0:cx1]
+          if kind == "mask":
+            GlyphAtlas._blit_mask(dst, src)
+          else:
+            GlyphAtlas._blit_rgba(dst, src)
+      x += advance
+    return Image.fromarray(canvas, "RGBA")
+
+  @staticmethod
+  def _blend(a, b, mask):
+    # 与 Pillow 相同的 8 位混合: a * (255 - mask) / 255 + b * mask / 255
+    tmp = a * (255 - mask) + b * mask + 128
+    return (tmp + (tmp >> 8)) >> 8
+
+  @staticmethod
+  def _blit_mask(dst, mask):
+    m = mask.astype(np.uint32)
+    alpha = dst[:, :, 3].astype(np.uint32)
+    dst[:, :, 3] = GlyphAtlas._blend(alpha, 255, m)
+    dst[:, :, :3][mask > 0] = 255
+
+  @staticmethod
+  def _blit_rgba(dst, src):
+    m = src[:, :, 3:4].astype(np.uint32)
+    dst[:, :, :] = GlyphAtlas._blend(dst.astype(np.uint32), src.astype(np.uint32), m)
+
+  def compare_with_reference(self, text):
+    """返回本合成器与逐字 draw.text 输出的最大像素差 (只比较可见部分)。"""
+    ours = np.asarray(self.render_line(text)).astype(np.int32)
+    reference = np.asarray(TextUtils.get_line_img_reference(text, self.font)).astype(np.int32)
+    if ours.shape != reference.shape:
+      return 255
+    # 完全透明像素的颜色不可见，只比较预乘后的结果
+    ours = ours[:, :, :3] * ours[:, :, 3:4] // 255
+    reference = reference[:, :, :3] * reference[:, :, 3:4] // 255
+    return int(np.abs(ours - reference).max()) if ours.size else 0
+
 
 class TextUtils:
   
   @staticmethod
   def get_char_size(font, char):
-    global char_size_cache
-    cache_key = (font.getname(), font.size, char)
-    if cache_key in char_size_cache:
-      return char_size_cache[cache_key]
+    cache_key = (FontUtils.font_key(font), char)
+    char_size = char_size_cache.get(cache_key)
+    if char_size is not None:
+      return char_size
     """获取字符的大小，返回宽度和高度。"""
     if EmojiUtils.is_emoji(char):
       emoji_img = EmojiUtils.get_local_emoji_svg_image(char, size=font.size)
       if emoji_img:
-        char_size_cache[cache_key] = (emoji_img.width, emoji_img.height)
-        return emoji_img.width, emoji_img.height
+        return char_size_cache.put(cache_key, (emoji_img.width, emoji_img.height))
+      # Unsupported symbols are cached too, so they are not looked up again
+      return char_size_cache.put(cache_key, (0, 0))
     else:
+      if isinstance(font, PackedFont):
+        glyph = font.get_packed_glyph(char)
+        if glyph is not None:
+          return char_size_cache.put(cache_key, (glyph[3], glyph[4]))
       bbox = font.getbbox(char)
-      char_size_cache[cache_key] = (bbox[2] - bbox[0], bbox[3] - bbox[1])
-      return char_size_cache[cache_key]
-    return 0, 0
+      return char_size_cache.put(cache_key, (bbox[2] - bbox[0], bbox[3] - bbox[1]))
   
   @staticmethod
   def draw_mixed_text(draw, image, text, font, start_xy):
@@ -167,19 +659,27 @@ class TextUtils:
         
   @staticmethod
   def get_line_img(text, font):
-    cache_key = (font.getname(), font.size, text)
-    if cache_key in line_image_cache:
-      return line_image_cache[cache_key]
+    cache_key = (FontUtils.font_key(font), text)
+    img = line_image_cache.get(cache_key)
+    if img is not None:
+      return img
+    img = GlyphAtlas.for_font(font).render_line(text)
+    return line_image_cache.put(cache_key, img)
+
+  @staticmethod
+  def get_line_img_reference(text, font):
+    """逐字调用 draw.text 绘制行图像 (不缓存)，作为 GlyphAtlas 输出的对照。"""
     x, y = 0, 0
     ascent, descent = font.getmetrics()
     baseline = y + ascent
     line_height = ascent + descent
+    units = EmojiUtils.split_emoji_sequences(text)
     width = 0
-    for char in text:
+    for char in units:
       width += TextUtils.get_char_size(font, char)[0]
     img = Image.new("RGBA", (width, line_height), (0, 0, 0, 0))
     draw = ImageDraw.Draw(img)
-    for char in text:
+    for char in units:
       if EmojiUtils.is_emoji(char):
         emoji_img = EmojiUtils.get_local_emoji_svg_image(char, size=font.size)
         if emoji_img:
@@ -190,14 +690,21 @@ class TextUtils:
         draw.text((x, y), char, font=font, fill=(255, 255, 255))
         char_width = TextUtils.get_char_size(font, char)[0]
         x += char_width
-    line_image_cache[cache_key] = img
-    return line_image_cache[cache_key]
+    return img
   
   @staticmethod
   def clean_line_image_cache():
     """清除行图像缓存。"""
-    global line_image_cache
-    line_image_cache = {}
+    line_image_cache.clear()
+
+  @staticmethod
+  def get_cache_stats():
+    """返回行图像、字符尺寸和 Emoji 图像缓存的命中/未命中/淘汰统计。"""
+    return {
+      "line_image": line_image_cache.stats(),
+      "char_size": char_size_cache.stats(),
+      "emoji_image": emoji_image_cache.stats(),
+    }
 
   @staticmethod
   def get_text_size(text, font):
@@ -207,22 +714,110 @@ class TextUtils:
     height = sum(TextUtils.get_line_img(line, font).height for line in lines)
     return width, height
 
+  @staticmethod
+  def get_break_class(char):
+    flags = char_break_classes.get(char)
+    if flags is None:
+      flags = 0
+      if char == " " or char == "\t":
+        flags |= BREAK_SPACE
+      if unicodedata.east_asian_width(char) in ("W", "F") or EmojiUtils.is_emoji(char):
+        flags |= BREAK_WIDE
+      if char in no_line_start_chars:
+        flags |= BREAK_NO_START
+      if char in no_line_end_chars:
+        flags |= BREAK_NO_END
+      char_break_classes[char] = flags
+    return flags
+
+  @staticmethod
+  def layout_text(text, font, max_width):
+    """将文本分行，返回每行的 (起始, 结束) 下标。
+
+    一次性查出所有字符的宽度并求前缀和，每行能放下的最后位置用 searchsorted
+    查找，再退回到最近的可换行位置: 英文在空格处换行 (行尾空格不计宽度)，
+    中日韩字符之间可直接换行，"\n" 强制换行。单词比整行还宽时在字符间断开。
+    多码点 Emoji 序列的宽度记在首字符上，序列内部不换行。
+    """
+    if not text:
+      return []
+    widths = {char: TextUtils.get_char_size(font, char)[0] for char in set(text)}
+    classes = {char: TextUtils.get_break_class(char) for char in widths}
+    n = len(text)
+    char_widths = np.fromiter((widths[char] for char in text), dtype=np.int64, count=n)
+    flags = np.fromiter((classes[char] for char in text), dtype=np.uint8, count=n)
+    # 序列内部的位置 (不能在它之前换行)
+    inside = np.zeros(n + 1, dtype=bool)
+    units = EmojiUtils.split_emoji_sequences(text)
+    if len(units) < n:
+      pos = 0
+      for unit in units:
+        if len(unit) > 1:
+          char_widths[pos] = TextUtils.get_char_size(font, unit)[0]
+          char_widths[pos + 1:pos + len(unit)] = 0
+          flags[pos:pos + len(unit)] = BREAK_WIDE
+          inside[pos + 1:pos + len(unit)] = True
+        pos += len(unit)
+    cum = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(char_widths, out=cum[1:])
+    is_space = (flags & BREAK_SPACE) != 0
+    # 允许换行的位置 e: 行可以在 text[e] 之前结束
+    cur, nxt = flags[:-1], flags[1:]
+    allowed = is_space[:-1] | (
+      ((cur | nxt) & BREAK_WIDE != 0) & (nxt & BREAK_NO_START == 0) & (cur & BREAK_NO_END == 0)
+    )
+    allowed &= ~inside[1:n]
+    breaks = np.flatnonzero(allowed) + 1
+    paragraph_ends = [i for i, char in enumerate(text) if char == "\n"]
+    paragraph_ends.append(n)
+
+    spans = []
+    start = 0
+    for paragraph_end in paragraph_ends:
+      while True:
+        fit = int(np.searchsorted(cum, cum[start] + max_width, side="right")) - 1
+        # 空格可以悬挂在行尾
+        while fit < paragraph_end and is_space[fit]:
+          fit += 1
+        if fit >= paragraph_end:
+          spans.append((start, paragraph_end))
+          break
+        k = int(np.searchsorted(breaks, fit, side="right")) - 1
+        end = int(breaks[k]) if k >= 0 and breaks[k] > start else max(fit, start + 1)
+        while inside[end]:
+          end += 1
+        spans.append((start, end))
+        start = end
+      start = paragraph_end + 1
+    return spans
+
   @staticmethod
   def wrap_text(draw, text, font, max_width):
-    lines = []
-    current_line = ""
-    current_width = 0
-    for char in text:
-      test_line = current_line + char
-      char_width = TextUtils.get_char_size(font, char)[0]
-      current_width += char_width
-      w = current_width
-      if w <= max_width:
-        current_line = test_line
-      else:
-        lines.append(current_line)
-        current_line = char
-        current_width = char_width
-    if current_line:
-      lines.append(current_line)
-    return lines
\ No newline at end of file
+    """兼容旧接口: 返回分行后的字符串列表。"""
+    return [text[start:end] for start, end in TextUtils.layout_text(text, font, max_width)]
+
+
+if __name__ == "__main__":
+  # 检查 GlyphAtlas 合成的行图像与逐字 draw.text 的输出一致 (FreeType 字体和字体包)
+  import sys
+  font_path = sys.argv[1] if len(sys.argv) > 1 else "NotoSansSC-Bold.ttf"
+  max_diff = 1
+  EmojiUtils.load_emoji_atlas()
+  EmojiUtils.load_emoji_index()
+  samples = [
+    "The quick brown fox jumps over the lazy dog. 0123456789",
+    "Hello, world! (a+b)*c = [x]; {y} @#$%^&~",
+    "你好，世界！今天天气怎么样？我们一起去公园散步吧。",
+    "混合 Mixed 文本 text，标点「符号」与 emoji 😄👍🎉",
+    "😀😃😄😁😆😅🤣😂🙂🙃",
+  ]
+  fonts = [("freetype", lambda size: ImageFont.truetype(font_path, size))]
+  if FontUtils.load_font_pack() is not None and font_pack.covers(font_path, 20):
+    fonts.append(("font pack", lambda size: FontUtils.get_font(font_path, size)))
+  for name, load in fonts:
+    for size in (13, 20, 24, 40):
+      atlas = GlyphAtlas.for_font(load(size))
+      for text in samples:
+        diff = atlas.compare_with_reference(text)
+        assert diff <= max_diff, f"{name} {size}px: max difference {diff} for {text!r}"
+      print(f"[GlyphAtlas] {name} {size}px: {len(samples)} lines within {max_diff}")
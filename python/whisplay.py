@@ -2,6 +2,9 @@ import RPi.GPIO as GPIO
 import spidev
 import time
 import threading
+import numpy as np
+
+import st7789
 
 
 class WhisplayBoard:
@@ -21,6 +24,21 @@ class WhisplayBoard:
     # Button pin
     BUTTON_PIN = 11
 
+    # Dirty-rectangle updates: if the changed area of a region exceeds this
+    # fraction (or it splits into more than DIRTY_MAX_RECTS bands), the whole
+    # region is sent instead of the individual rectangles.
+    DIRTY_FULL_REFRESH_RATIO = 0.6
+    DIRTY_MAX_RECTS = 8
+
+    # ST7789 frame memory height, the panel shows rows 20..299 of it
+    FRAME_MEMORY_ROWS = 320
+    ROW_OFFSET = 20
+
+    # Largest single SPI transfer the spidev driver accepts (module parameter,
+    # can be raised with spidev.bufsiz=65536 in /boot/firmware/cmdline.txt)
+    SPI_BUFSIZ_PATH = "/sys/module/spidev/parameters/bufsiz"
+    DEFAULT_SPI_BUFSIZ = 4096
+
     def __init__(self):
         GPIO.setmode(GPIO.BOARD)
         GPIO.setwarnings(False)
@@ -64,8 +82,26 @@ class WhisplayBoard:
         self.spi.open(0, 0)
         self.spi.max_speed_hz = 100_000_000
         self.spi.mode = 0b00
-
-        self.previous_frame = None
+        self.spi_bufsiz = self._read_spi_bufsiz()
+        # writebytes2 takes any buffer; older spidev releases only have writebytes
+        self._spi_write = getattr(self.spi, "writebytes2", None)
+        self.spi_stats = {"bytes": 0, "transfers": 0, "seconds": 0.0}
+        self.last_frame_stats = None
+        # Current level of the DC pin and the CASET/RASET parameters last
+        # sent, so unchanged state is not written again
+        self._dc_level = None
+        self._window_columns = None
+        self._window_rows = None
+
+        # Shadow copy of the panel contents (raw RGB565 as sent over SPI),
+        # used to only send the parts of a region that actually changed
+        self.framebuffer = np.zeros((self.LCD_HEIGHT, self.LCD_WIDTH), dtype=np.uint16)
+        self.dirty_tracking = True
+        self.dirty_full_refresh_ratio = self.DIRTY_FULL_REFRESH_RATIO
+        self.dirty_max_rects = self.DIRTY_MAX_RECTS
+        # Hardware vertical scroll region (top, height) in display rows
+        self.scroll_area = None
+        self.scroll_start = 0
         self._reset_lcd()
         self._init_display()
         self.fill_screen(0)
@@ -79,6 +115,8 @@ class WhisplayBoard:
             self.backlight_pwm.ChangeDutyCycle(duty_cycle)
 
     def _reset_lcd(self):
+        self._window_columns = None
+        self._window_rows = None
         GPIO.output(self.RST_PIN, GPIO.HIGH)
         time.sleep(0.1)
         GPIO.output(self.RST_PIN, GPIO.LOW)
@@ -92,6 +130,7 @@ class WhisplayBoard:
         USE_HORIZONTAL = 1
         direction = {0: 0x00, 1: 0xC0, 2: 0x70, 3: 0xA0}.get(USE_HORIZONTAL, 0x00)
         self._send_command(0x36, direction)
+        self.madctl = direction
         self._send_command(0x3A, 0x05)
         self._send_command(0xB2, 0x0C, 0x0C, 0x00, 0x33, 0x33)
         self._send_command(0xB7, 0x35)
@@ -139,36 +178,129 @@ class WhisplayBoard:
         self._send_command(0x29)
 
     def _send_command(self, cmd, *args):
-        GPIO.output(self.DC_PIN, GPIO.LOW)
-        self.spi.xfer2([cmd])
-        if args:
-            GPIO.output(self.DC_PIN, GPIO.HIGH)
-            self._send_data(list(args))
+        self.send_command_batch([(cmd, args)])
+
+    def send_command_batch(self, commands):
+        """Send a sequence of (command, params) pairs.
+
+        Consecutive bytes with the same DC level (command bytes low, params
+        high) go out in one SPI transfer and the DC pin is only written when
+        its level changes.
+        """
+        runs = []
+        for cmd, params in commands:
+            for level, data in ((GPIO.LOW, (cmd,)), (GPIO.HIGH, params)):
+                if not data:
+                    continue
+                if runs and runs[-1][0] == level:
+                    runs[-1][1].extend(data)
+                else:
+                    runs.append((level, bytearray(data)))
+        for level, data in runs:
+            if level == GPIO.LOW:
+                self._set_dc(GPIO.LOW)
+                self.spi.xfer2(list(data))
+            else:
+                self._send_data(data)
+
+    def _set_dc(self, level):
+        if self._dc_level != level:
+            GPIO.output(self.DC_PIN, level)
+            self._dc_level = level
+
+    def _read_spi_bufsiz(self):
+        try:
+            with open(self.SPI_BUFSIZ_PATH) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return self.DEFAULT_SPI_BUFSIZ
 
     def _send_data(self, data):
-        GPIO.output(self.DC_PIN, GPIO.HIGH)
-        max_chunk = 4096
-        for i in range(0, len(data), max_chunk):
-            self.spi.writebytes(data[i : i + max_chunk])
+        """Send bytes, a list of ints or any contiguous buffer (e.g. a numpy
+        array) as data, in as few bufsiz-sized transfers as possible"""
+        self._set_dc(GPIO.HIGH)
+        if isinstance(data, list):
+            data = bytes(data)
+        # Chunks are memoryview slices, nothing is copied on the way to spidev
+        view = memoryview(data).cast("B")
+        start_time = time.perf_counter()
+        transfers = 0
+        for i in range(0, len(view), self.spi_bufsiz):
+            chunk = view[i : i + self.spi_bufsiz]
+            if self._spi_write is not None:
+                self._spi_write(chunk)
+            else:
+                self.spi.writebytes(chunk.tolist())
+            transfers += 1
+        self.spi_stats["bytes"] += len(view)
+        self.spi_stats["transfers"] += transfers
+        self.spi_stats["seconds"] += time.perf_counter() - start_time
+
+    def get_spi_stats(self):
+        """Return cumulative SPI data totals and the stats of the last draw_image"""
+        stats = dict(self.spi_stats, bufsiz=self.spi_bufsiz)
+        stats["bytes_per_second"] = stats["bytes"] / stats["seconds"] if stats["seconds"] else 0
+        stats["last_frame"] = self.last_frame_stats
+        return stats
+
+    def configure_dirty_tracking(self, enabled=True, full_refresh_ratio=None, max_rects=None):
+        self.dirty_tracking = enabled
+        if full_refresh_ratio is not None:
+            self.dirty_full_refresh_ratio = full_refresh_ratio
+        if max_rects is not None:
+            self.dirty_max_rects = max_rects
 
     def set_window(self, x0, y0, x1, y1, use_horizontal=0):
+        columns = rows = None
         if use_horizontal in (0, 1):
-            self._send_command(0x2A, x0 >> 8, x0 & 0xFF, x1 >> 8, x1 & 0xFF)
-            self._send_command(
-                0x2B, (y0 + 20) >> 8, (y0 + 20) & 0xFF, (y1 + 20) >> 8, (y1 + 20) & 0xFF
-            )
+            columns = (x0 >> 8, x0 & 0xFF, x1 >> 8, x1 & 0xFF)
+            rows = ((y0 + 20) >> 8, (y0 + 20) & 0xFF, (y1 + 20) >> 8, (y1 + 20) & 0xFF)
         elif use_horizontal in (2, 3):
-            self._send_command(
-                0x2A, (x0 + 20) >> 8, (x0 + 20) & 0xFF, (x1 + 20) >> 8, (x1 + 20) & 0xFF
-            )
-            self._send_command(0x2B, y0 >> 8, y0 & 0xFF, y1 >> 8, y1 & 0xFF)
-        self._send_command(0x2C)
+            columns = ((x0 + 20) >> 8, (x0 + 20) & 0xFF, (x1 + 20) >> 8, (x1 + 20) & 0xFF)
+            rows = (y0 >> 8, y0 & 0xFF, y1 >> 8, y1 & 0xFF)
+        # CASET/RASET are only resent when the window changes; RAMWR is always
+        # needed since it restarts writing at the top left of the window
+        commands = []
+        if columns is not None and columns != self._window_columns:
+            commands.append((0x2A, columns))
+            self._window_columns = columns
+        if rows is not None and rows != self._window_rows:
+            commands.append((0x2B, rows))
+            self._window_rows = rows
+        commands.append((0x2C, ()))
+        self.send_command_batch(commands)
+
+    # ========== Vertical Scrolling ==========
+    def define_scroll_area(self, top, height):
+        """Use display rows top..top+height-1 as the hardware vertical scroll region"""
+        top_fixed, height, bottom_fixed = st7789.scroll_area_registers(
+            top + self.ROW_OFFSET, height, self.madctl, self.FRAME_MEMORY_ROWS)
+        self._send_command(
+            0x33,
+            top_fixed >> 8, top_fixed & 0xFF,
+            height >> 8, height & 0xFF,
+            bottom_fixed >> 8, bottom_fixed & 0xFF,
+        )
+        self.scroll_area = (top, height)
+        self.scroll_start = -1
+        self.set_scroll_start(0)
+
+    def set_scroll_start(self, row):
+        """Show row `row` of the scroll region at the top of the region"""
+        if self.scroll_area is None or row == self.scroll_start:
+            return
+        top, height = self.scroll_area
+        address = st7789.scroll_start_address(top + self.ROW_OFFSET, height, row, self.madctl, self.FRAME_MEMORY_ROWS)
+        self._send_command(0x37, address >> 8, address & 0xFF)
+        self.scroll_start = row
 
     def draw_pixel(self, x, y, color):
         if x >= self.LCD_WIDTH or y >= self.LCD_HEIGHT:
             return
         self.set_window(x, y, x, y)
-        self._send_data([(color >> 8) & 0xFF, color & 0xFF])
+        pixel = bytes([(color >> 8) & 0xFF, color & 0xFF])
+        self._send_data(pixel)
+        self.framebuffer[y, x] = np.frombuffer(pixel, dtype=np.uint16)[0]
 
     def draw_line(self, x0, y0, x1, y1, color):
         dx = abs(x1 - x0)
@@ -191,18 +323,63 @@ class WhisplayBoard:
 
     def fill_screen(self, color):
         self.set_window(0, 0, self.LCD_WIDTH - 1, self.LCD_HEIGHT - 1)
-        buffer = []
         high = (color >> 8) & 0xFF
         low = color & 0xFF
-        for _ in range(self.LCD_WIDTH * self.LCD_HEIGHT):
-            buffer.extend([high, low])
-        self._send_data(buffer)
+        self._send_data(bytes([high, low]) * (self.LCD_WIDTH * self.LCD_HEIGHT))
+        self.framebuffer[:, :] = np.frombuffer(bytes([high, low]), dtype=np.uint16)[0]
 
     def draw_image(self, x, y, width, height, pixel_data):
         if (x + width > self.LCD_WIDTH) or (y + height > self.LCD_HEIGHT):
             raise ValueError("Image size exceeds screen bounds")
+        if isinstance(pixel_data, list):
+            pixel_data = bytes(pixel_data)
+        frame = np.frombuffer(pixel_data, dtype=np.uint16).reshape(height, width)
+        shadow = self.framebuffer[y : y + height, x : x + width]
+        bytes_before = self.spi_stats["bytes"]
+        transfers_before = self.spi_stats["transfers"]
+        start_time = time.perf_counter()
+        if not self.dirty_tracking:
+            self._send_region(x, y, frame)
+        else:
+            for rx, ry, rw, rh in self._dirty_rects(shadow, frame):
+                self._send_region(x + rx, y + ry, frame[ry : ry + rh, rx : rx + rw])
+        shadow[:, :] = frame
+        self.last_frame_stats = {
+            "bytes": self.spi_stats["bytes"] - bytes_before,
+            "transfers": self.spi_stats["transfers"] - transfers_before,
+            "seconds": time.perf_counter() - start_time,
+        }
+
+    def _send_region(self, x, y, pixels):
+        height, width = pixels.shape
         self.set_window(x, y, x + width - 1, y + height - 1)
-        self._send_data(pixel_data)
+        self._send_data(np.ascontiguousarray(pixels))
+
+    def _dirty_rects(self, old, new):
+        """Return the changed bands of a region as (x, y, w, h) rectangles
+        relative to the region, or the full region when diffing is not worth it."""
+        height, width = new.shape
+        diff = old != new
+        changed_rows = np.flatnonzero(diff.any(axis=1))
+        if changed_rows.size == 0:
+            return []
+        full = [(0, 0, width, height)]
+        # Split the changed rows into runs of consecutive rows
+        breaks = np.flatnonzero(np.diff(changed_rows) > 1)
+        starts = np.concatenate(([changed_rows[0]], changed_rows[breaks + 1]))
+        ends = np.concatenate((changed_rows[breaks], [changed_rows[-1]])) + 1
+        if len(starts) > self.dirty_max_rects:
+            return full
+        rects = []
+        area = 0
+        for start, end in zip(starts, ends):
+            changed_cols = np.flatnonzero(diff[start:end].any(axis=0))
+            left, right = changed_cols[0], changed_cols[-1] + 1
+            rects.append((int(left), int(start), int(right - left), int(end - start)))
+            area += (right - left) * (end - start)
+        if area > width * height * self.dirty_full_refresh_ratio:
+            return full
+        return rects
 
     # ========== RGB and Button Functions ==========
     def set_rgb(self, r, g, b):
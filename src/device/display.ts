@@ -2,6 +2,13 @@ import { exec } from "child_process";
 import { resolve } from "path";
 import { Socket } from "net";
 import { getCurrentTimeTag } from "../utils";
+import dotenv from "dotenv";
+
+dotenv.config();
+
+// When set, the display is reached over this Unix domain socket instead of
+// TCP (the Python server listens on it too, see WHISPLAY_DISPLAY_SOCKET)
+const displaySocketPath = process.env.WHISPLAY_DISPLAY_SOCKET || "";
 
 interface Status {
   status: string;
@@ -42,6 +49,15 @@ export class WhisplayDisplay {
   private buttonPressTimeArray: number[] = [];
   private buttonReleaseTimeArray: number[] = [];
   private buttonDetectInterval: NodeJS.Timeout | null = null;
+  // Streamed text is sent as appends numbered by textSeq; textSynced is false
+  // until the display holds our full text under a sequence number
+  private textSeq = 0;
+  private textSynced = false;
+  // After the handshake both directions use frames of a 4-byte big-endian
+  // length followed by a JSON payload instead of newline-delimited JSON
+  private framed = false;
+  private onHandshake: (() => void) | null = null;
+  private receiveBuffer = Buffer.alloc(0);
 
   constructor() {
     this.startPythonProcess();
@@ -140,61 +156,128 @@ export class WhisplayDisplay {
   }
 
   async connect(): Promise<void> {
-    console.log("Connecting to local display socket...");
+    console.log(
+      `Connecting to local display socket ${displaySocketPath || "0.0.0.0:12345"}...`
+    );
     return new Promise<void>((resolve, reject) => {
       // 销毁原来的this.client
       if (this.client) {
         this.client.destroy();
       }
       this.client = new Socket();
-      this.client.connect(12345, "0.0.0.0", () => {
+      const onConnect = () => {
         console.log("Connected to local display socket");
-        this.sendToDisplay(JSON.stringify(this.currentStatus));
-        resolve();
-      });
-      this.client.on("data", (data: Buffer) => {
-        const dataString = data.toString();
-        if (dataString.trim() === "OK") {
-          return;
-        }
-        console.log(
-          `[${getCurrentTimeTag()}] Received data from Whisplay hat:`,
-          dataString
+        this.textSynced = false;
+        this.framed = false;
+        this.receiveBuffer = Buffer.alloc(0);
+        // Ask for length-prefixed frames without acknowledgements (errors and
+        // events are still sent); the display confirms with a "framing" event
+        // (a display without framing support answers OK)
+        this.onHandshake = () => {
+          this.onHandshake = null;
+          this.sendToDisplay(JSON.stringify(this.currentStatus));
+          resolve();
+        };
+        this.client?.write(
+          JSON.stringify({
+            framing: "length-prefixed",
+            codec: "json",
+            acks: "none",
+          }) + "\n"
         );
-        try {
-          const json = JSON.parse(dataString);
-          if (json.event === "button_pressed") {
-            this.buttonPressTimeArray.push(Date.now());
-            this.startMonitoringDoubleClick();
-            if (!this.buttonDetectInterval) {
-              console.log('emit pressed')
-              this.buttonPressedCallback();
-            }
-          }
-          if (json.event === "button_released") {
-            this.buttonReleaseTimeArray.push(Date.now());
-            if (!this.buttonDetectInterval) {
-              console.log('emit released')
-              this.buttonReleasedCallback();
-            }
-          }
-          if (json.event === "camera_capture") {
-            this.onCameraCaptureCallback();
-          }
-        } catch {
-          console.error("Failed to parse JSON from data");
-        }
+      };
+      if (displaySocketPath) {
+        this.client.connect({ path: displaySocketPath }, onConnect);
+      } else {
+        this.client.connect(12345, "0.0.0.0", onConnect);
+      }
+      this.client.on("data", (data: Buffer) => {
+        // Messages may be split or batched by the socket, only complete ones are
+        // decoded so multi-byte characters are never cut in half
+        this.receiveBuffer = Buffer.concat([this.receiveBuffer, data]);
+        this.processReceiveBuffer();
       });
       this.client.on("error", (err: any) => {
         console.error("Display Socket error:", err);
-        // 如果是ECONNREFUSED
-        if (err.code === "ECONNREFUSED") {
+        // 如果是ECONNREFUSED (or the Unix socket does not exist yet)
+        if (err.code === "ECONNREFUSED" || err.code === "ENOENT") {
           reject(err);
         }
       });
     });
   }
 
+  private processReceiveBuffer(): void {
+    const buffer = this.receiveBuffer;
+    let offset = 0;
+    while (offset < buffer.length) {
+      if (this.framed) {
+        if (buffer.length - offset < 4) break;
+        const length = buffer.readUInt32BE(offset);
+        if (buffer.length - offset - 4 < length) break;
+        this.handleDisplayMessage(
+          buffer.toString("utf8", offset + 4, offset + 4 + length)
+        );
+        offset += 4 + length;
+      } else {
+        const end = buffer.indexOf(10, offset);
+        if (end === -1) break;
+        this.handleDisplayMessage(buffer.toString("utf8", offset, end).trim());
+        offset = end + 1;
+      }
+    }
+    this.receiveBuffer = buffer.subarray(offset);
+  }
+
+  private handleDisplayMessage(dataString: string): void {
+    if (!dataString) {
+      return;
+    }
+    if (dataString === "OK" || dataString === '{"ok":true}') {
+      this.onHandshake?.();
+      return;
+    }
+    console.log(
+      `[${getCurrentTimeTag()}] Received data from Whisplay hat:`,
+      dataString
+    );
+    try {
+      const json = JSON.parse(dataString);
+      if (json.event === "framing") {
+        this.framed = json.framing === "length-prefixed";
+        this.onHandshake?.();
+        return;
+      }
+      if (json.event === "button_pressed") {
+        this.buttonPressTimeArray.push(Date.now());
+        this.startMonitoringDoubleClick();
+        if (!this.buttonDetectInterval) {
+          console.log('emit pressed')
+          this.buttonPressedCallback();
+        }
+      }
+      if (json.event === "button_released") {
+        this.buttonReleaseTimeArray.push(Date.now());
+        if (!this.buttonDetectInterval) {
+          console.log('emit released')
+          this.buttonReleasedCallback();
+        }
+      }
+      if (json.event === "camera_capture") {
+        this.onCameraCaptureCallback();
+      }
+      if (json.event === "text_resync") {
+        // The display missed an append, send the whole text again
+        this.textSynced = false;
+        this.sendToDisplay(
+          JSON.stringify(this.buildTextUpdate("", this.currentStatus.text))
+        );
+      }
+    } catch {
+      console.error("Failed to parse JSON from data");
+    }
+  }
+
   onButtonPressed(callback: () => void): void {
     this.buttonPressedCallback = callback;
   }
@@ -214,6 +297,13 @@ export class WhisplayDisplay {
   private async sendToDisplay(data: string): Promise<void> {
     await this.isReady;
     try {
+      if (this.framed) {
+        const payload = Buffer.from(data, "utf8");
+        const header = Buffer.alloc(4);
+        header.writeUInt32BE(payload.length);
+        this.client?.write(Buffer.concat([header, payload]));
+        return;
+      }
       this.client?.write(`${data}\n`, "utf8", () => {
         // console.log("send", data);
       });
@@ -222,6 +312,23 @@ export class WhisplayDisplay {
     }
   }
 
+  // Only the new part of streamed text goes over the socket; anything that
+  // is not a continuation of the previous text replaces it
+  private buildTextUpdate(
+    previousText: string,
+    text: string
+  ): { text_append: string; text_seq: number } | { text_replace: string; text_seq: number } {
+    this.textSeq += 1;
+    if (this.textSynced && previousText && text.startsWith(previousText)) {
+      return {
+        text_append: text.slice(previousText.length),
+        text_seq: this.textSeq,
+      };
+    }
+    this.textSynced = true;
+    return { text_replace: text, text_seq: this.textSeq };
+  }
+
   getCurrentStatus(): Status {
     return this.currentStatus;
   }
@@ -246,6 +353,7 @@ export class WhisplayDisplay {
     );
 
     const isTextChanged = changedValues.some(([key]) => key === "text");
+    const previousText = this.currentStatus.text;
 
     this.currentStatus.status = status;
     this.currentStatus.emoji = emoji;
@@ -257,6 +365,10 @@ export class WhisplayDisplay {
     this.currentStatus.image = image;
 
     const changedValuesObj = Object.fromEntries(changedValues);
+    if (isTextChanged) {
+      delete changedValuesObj.text;
+      Object.assign(changedValuesObj, this.buildTextUpdate(previousText, text));
+    }
     changedValuesObj.brightness = 100;
     const data = JSON.stringify(changedValuesObj);
     if (isTextChanged) console.log("send data:", data);